@@ -1,11 +1,128 @@
 import os
+import re
 import json
+import time
+from datetime import date
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import BoundedSemaphore, Lock, get_ident, local
 
 # Import the requests library from the lambda layer
 import sys
 sys.path.append("/opt/python/lib/python3.9/site-packages/")
+import boto3
 import requests
+import numpy as np
+from requests.adapters import HTTPAdapter
 
+# Statement types returned by get_financial_statements, with the API endpoint and the
+# key of the statement list in the API response
+STATEMENT_TYPES = {
+    "income_statement": ("income-statements", "income_statements"),
+    "balance_sheet": ("balance-sheets", "balance_sheets"),
+    "cash_flow_statement": ("cash-flow-statements", "cash_flow_statements"),
+}
+STATEMENT_ALIASES = {
+    "income": "income_statement", "income_statements": "income_statement",
+    "balance": "balance_sheet", "balance_sheets": "balance_sheet",
+    "cash_flow": "cash_flow_statement", "cash_flow_statements": "cash_flow_statement", "cashflow": "cash_flow_statement",
+}
+# Keys that identify a statement rather than being line items of it
+STATEMENT_ID_KEYS = ("ticker", "report_period", "period", "currency")
+MAX_WORKERS = 8
+# Seconds a request to the API may take to connect or to send data before it is given up
+API_TIMEOUT_SECONDS = float(os.environ.get("API_TIMEOUT_SECONDS", 10))
+
+# Peer comparison: the most tickers compared in one call and the seconds after which
+# the comparison returns with the results it has, listing the tickers still pending
+MAX_PEER_TICKERS = 20
+PEER_DEADLINE_SECONDS = float(os.environ.get("PEER_DEADLINE_SECONDS", 10))
+
+# Statement periods served from the quarterly statements of a ticker. The quarterly
+# statements are fetched once (at least QUARTERLY_HISTORY_LIMIT quarters) and cached in
+# memory and under STATEMENT_CACHE_DIR until the company may have filed newer ones (see
+# FreshnessIndex). Line items of the income and cash flow statements are summed over
+# four quarters for ttm and annual statements, except for share counts, which are averaged
+STATEMENT_PERIODS = ("ttm", "quarterly", "annual")
+QUARTERLY_HISTORY_LIMIT = 40
+STATEMENT_CACHE_DIR = os.environ.get("STATEMENT_CACHE_DIR", "/tmp/statements")
+FLOW_STATEMENT_TYPES = ("income_statement", "cash_flow_statement")
+AVERAGED_FLOW_FIELDS = ("weighted_average_shares", "weighted_average_shares_diluted")
+
+# Filing window of the next quarter after the latest report period of a ticker, in
+# days after that quarter ends (early filers report within a month, 10-Ks of smaller
+# companies are due after 90 days), and how often a cheap revalidation probe may be
+# sent once the window is open
+FILING_WINDOW_OPEN_DAYS = 20
+FILING_WINDOW_CLOSE_DAYS = 95
+FRESHNESS_PROBE_INTERVAL_SECONDS = 6 * 60 * 60
+
+# Line items the ratio engine reads from each statement type
+RATIO_FIELDS = {
+    "income_statement": ("revenue", "gross_profit", "operating_income", "net_income", "interest_expense",
+                         "income_tax_expense", "earnings_per_share"),
+    "balance_sheet": ("total_assets", "current_assets", "current_liabilities", "total_liabilities",
+                      "shareholders_equity", "total_debt", "cash_and_equivalents", "inventory"),
+    "cash_flow_statement": ("net_cash_flow_from_operations", "capital_expenditure", "free_cash_flow"),
+}
+
+# Factor table of the screener: where the batch job writes it (and optionally uploads
+# it to S3, as s3://bucket/key, so that every lambda instance can read it), how often
+# an instance checks whether the S3 table was rebuilt, how many periods per ticker it
+# holds, and the default and largest number of screen results
+FACTOR_TABLE_PATH = os.environ.get("FACTOR_TABLE_PATH", "/tmp/factor_table.npz")
+FACTOR_TABLE_S3_URI = os.environ.get("FACTOR_TABLE_S3_URI")
+FACTOR_TABLE_CHECK_SECONDS = float(os.environ.get("FACTOR_TABLE_CHECK_SECONDS", 300))
+FACTOR_TABLE_PERIODS = 4
+DEFAULT_SCREEN_TOP_K = 10
+MAX_SCREEN_TOP_K = 100
+SCREEN_FILTER_PATTERN = re.compile(r"^\s*(\w+)\s*(<=|>=|<|>|==|=)\s*(-?[\d.]+(?:e-?\d+)?)\s*$", re.IGNORECASE)
+
+# Monte Carlo DCF: default and largest number of scenarios, scenarios valued at once
+# (which bounds memory), forecast years, annual history used for the growth and free
+# cash flow margin distributions, the distributions of the discount rate and terminal
+# growth, the smallest spread kept between them, the range the mean revenue growth is
+# clipped to, and the intrinsic value percentiles reported
+DCF_DEFAULT_SIMULATIONS = 100000
+DCF_MAX_SIMULATIONS = 1000000
+DCF_CHUNK_SIZE = 25000
+DCF_DEFAULT_YEARS = 5
+DCF_HISTORY_YEARS = 5
+DCF_DEFAULT_DISCOUNT_RATE = 0.09
+DCF_DISCOUNT_RATE_STD = 0.01
+DCF_DEFAULT_TERMINAL_GROWTH = 0.025
+DCF_TERMINAL_GROWTH_STD = 0.005
+DCF_MIN_RATE_SPREAD = 0.01
+DCF_GROWTH_BOUNDS = (-0.10, 0.30)
+DCF_PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+# Pooled HTTP session shared by all requests to the financial datasets API, so that
+# connections are reused across invocations and concurrent fetches. get_financial_ratios,
+# compare_peers and the factor table job fetch several tickers at once, and
+# get_financial_statements fetches the statement types of a ticker on workers of its
+# own, so api_get holds the requests in flight to MAX_WORKERS with a semaphore
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+api_request_slots = BoundedSemaphore(MAX_WORKERS)
+# Monotonic time by which the requests of the current thread have to finish, set by
+# compare_peers on its workers so that fetches abandoned at its deadline give up too
+request_deadline = local()
+
+
+def api_get(url, **kwargs):
+    """
+    GET on the shared session, waiting for a free request slot first. Requests time out
+    after API_TIMEOUT_SECONDS, or at the deadline of the calling thread when it is sooner
+    """
+    with api_request_slots:
+        timeout = API_TIMEOUT_SECONDS
+        deadline = getattr(request_deadline, "at", None)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                raise requests.Timeout(f"Deadline reached before requesting {url.split('?')[0]}")
+        kwargs.setdefault("timeout", timeout)
+        return http_session.get(url, **kwargs)
 
 def get_named_parameter(event, name):
     """
@@ -13,72 +130,919 @@ def get_named_parameter(event, name):
     """
     return next(item for item in event['parameters'] if item['name'] == name)['value']
 
-def get_income_statements(ticker, period="ttm", limit=10):
+def get_optional_parameter(event, name, default=None):
     """
-    Get income statements for a ticker. This is one of the functions that is used to get the 
-    income statements based on the ticker specified by the user
+    Get a parameter from the lambda event, or the default when it was not sent
     """
-    api_key = os.environ.get("FINANCIAL_DATASET_API")
-    if not api_key:
-        return {"error": "Missing FINANCIAL_DATASET_API environment variable"}
+    return next((item['value'] for item in event.get('parameters', []) if item['name'] == name and item['value'] != ''), default)
 
+def fetch_statements(statement_type, ticker, period, limit, api_key):
+    """
+    Fetch the latest statements of one type and period for a ticker on the shared
+    session. Returns the list of statements (newest first), or raises on an API error
+    """
+    endpoint, key = STATEMENT_TYPES[statement_type]
     url = (
-        f'https://api.financialdatasets.ai/financials/income-statements'
+        f'https://api.financialdatasets.ai/financials/{endpoint}'
         f'?ticker={ticker}'
         f'&period={period}'
         f'&limit={limit}'
     )
+    response = api_get(url, headers={'X-API-Key': api_key})
+    if response.status_code != 200:
+        raise RuntimeError(f"API returned status code {response.status_code}: {response.text}")
+    return response.json().get(key, [])
+
+class FreshnessIndex:
+    """
+    Index of the latest report period known for each ticker and the window in which its
+    next quarterly filing is expected. Before the window opens, cached statements are
+    served without any network call; once it is open (or has passed without a filing),
+    a revalidation probe is due at most every FRESHNESS_PROBE_INTERVAL_SECONDS. The
+    index is kept in memory and persisted as one JSON file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def latest(self, ticker):
+        entry = self._entries.get(ticker)
+        return entry["report_period"] if entry else None
+
+    def record(self, ticker, report_period):
+        """
+        Record the latest report period of a ticker as checked now, with the filing
+        window of the quarter after it
+        """
+        entry = {"report_period": report_period, "checked_at": time.time()}
+        if report_period:
+            next_period_end = np.datetime64(report_period[:7], "M") + 4 - np.timedelta64(1, "D")
+            entry["window_start"] = str(next_period_end + FILING_WINDOW_OPEN_DAYS)
+            entry["window_end"] = str(next_period_end + FILING_WINDOW_CLOSE_DAYS)
+        with self._lock:
+            self._entries[ticker] = entry
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                # Written aside and moved into place, so a crash never leaves a truncated index
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Could not persist the freshness index: {e}")
+
+    def needs_probe(self, ticker):
+        """
+        Whether newer statements than the recorded ones can plausibly exist and the
+        ticker has not been checked within the probe interval
+        """
+        entry = self._entries.get(ticker)
+        if entry is None:
+            return True
+        if entry.get("window_start") and date.today().isoformat() < entry["window_start"]:
+            return False
+        return time.time() - entry["checked_at"] >= FRESHNESS_PROBE_INTERVAL_SECONDS
+
+def _latest_report_period(statements):
+    return max((statement["report_period"] for statement in statements), default=None)
+
+class QuarterlyStatementStore:
+    """
+    Cache of the quarterly statements of each ticker and statement type, kept in memory
+    and as JSON files in a directory so that they survive across invocations of a warm
+    lambda. Every statement period is derived from these (see derive_statements), and
+    the freshness index decides when the cache has to be revalidated
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._memory = {}
+        self.freshness = FreshnessIndex(os.path.join(directory, "freshness.json"))
+
+    def _path(self, statement_type, ticker):
+        return os.path.join(self.directory, f"{ticker}_{statement_type}.json")
+
+    def _load(self, statement_type, ticker):
+        key = (statement_type, ticker)
+        if key not in self._memory:
+            try:
+                with open(self._path(statement_type, ticker)) as f:
+                    self._memory[key] = json.load(f)
+            except (OSError, ValueError):
+                return None
+        return self._memory[key]
+
+    def _save(self, statement_type, ticker, entry):
+        self._memory[(statement_type, ticker)] = entry
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written to a file of this thread and moved into place, so that concurrent saves
+            # of the same statements and crashes never leave a partly written file
+            tmp_path = f"{self._path(statement_type, ticker)}.{get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(statement_type, ticker))
+        except OSError as e:
+            print(f"Could not persist the {statement_type} statements of {ticker}: {e}")
+
+    def get(self, statement_type, ticker, quarters, api_key):
+        """
+        At least `quarters` quarterly statements (fewer if the company has not filed as
+        many). Cached statements that cover the request are served as they are until the
+        next filing window of the ticker opens; after that a probe for the latest
+        quarter decides whether they are still current. Otherwise they are fetched
+        """
+        entry = self._load(statement_type, ticker)
+        covered = entry is not None and (entry["limit"] >= quarters or len(entry["statements"]) < entry["limit"])
+        if covered:
+            cached_latest = _latest_report_period(entry["statements"])
+            # Statements fetched before a newer filing was seen (through another
+            # statement type) are stale without probing
+            if (entry.get("known_latest") or "") >= (self.freshness.latest(ticker) or ""):
+                if not self.freshness.needs_probe(ticker):
+                    print(f"Serving cached {statement_type} statements of {ticker} through {cached_latest}")
+                    return entry["statements"]
+                probed_latest = _latest_report_period(fetch_statements(statement_type, ticker, "quarterly", 1, api_key))
+                if probed_latest is None or (cached_latest and probed_latest <= cached_latest):
+                    print(f"Revalidated cached {statement_type} statements of {ticker} through {cached_latest}")
+                    self.freshness.record(ticker, cached_latest)
+                    return entry["statements"]
+                print(f"New {statement_type} statements of {ticker} for {probed_latest}")
+
+        limit = max(quarters, QUARTERLY_HISTORY_LIMIT)
+        statements = fetch_statements(statement_type, ticker, "quarterly", limit, api_key)
+        known_latest = max(_latest_report_period(statements) or "", self.freshness.latest(ticker) or "") or None
+        self.freshness.record(ticker, known_latest)
+        self._save(statement_type, ticker, {
+            "fetched_at": time.time(), "limit": limit, "known_latest": known_latest, "statements": statements
+        })
+        return statements
+
+    def annual_report_period(self, statement_type, ticker, api_key):
+        """
+        Report period of the latest annual statement of a ticker, which marks its fiscal
+        year end when the quarterly statements do not tell it. Fetched once per cached
+        quarterly entry
+        """
+        entry = self._load(statement_type, ticker)
+        if entry is not None and "annual_report_period" in entry:
+            return entry["annual_report_period"]
+        report_period = _latest_report_period(fetch_statements(statement_type, ticker, "annual", 1, api_key))
+        if entry is not None:
+            self._save(statement_type, ticker, {**entry, "annual_report_period": report_period})
+        return report_period
+
+statement_store = QuarterlyStatementStore(STATEMENT_CACHE_DIR)
+
+def fiscal_year_end(statements):
+    """
+    A fiscal year end date inferred from the quarter sequence: the first statement with
+    a fiscal period (Q1 to Q4) places the year end that many quarters after its report
+    period. None when no statement has a fiscal period
+    """
+    for statement in statements:
+        match = re.search(r"Q([1-4])$", str(statement.get("fiscal_period") or "").upper())
+        if match:
+            return str(np.datetime64(statement["report_period"][:10]) + 91 * (4 - int(match.group(1))))
+    return None
+
+def _is_fiscal_year_end(statement, year_end):
+    """
+    Whether a quarterly statement closes a fiscal year: its fiscal period is the fourth
+    quarter when the API reports it, otherwise its report period falls within half a
+    quarter of a whole number of years from a known fiscal year end
+    """
+    fiscal_period = statement.get("fiscal_period")
+    if fiscal_period:
+        return str(fiscal_period).upper().endswith("Q4")
+    if not year_end:
+        return False
+    days = int((np.datetime64(statement["report_period"][:10]) - np.datetime64(year_end[:10])).astype(int)) % 365.25
+    return min(days, 365.25 - days) <= 45
+
+def derive_statements(statements, statement_type, period, year_end=None):
+    """
+    Statements of the requested period from quarterly statements (newest first).
+    Quarterly statements are returned as they are. For ttm statements every window of
+    four consecutive quarters gives one statement: flow line items are summed over the
+    window (share counts averaged) and balance sheet items are those of the latest
+    quarter. Annual statements are the ttm statements that end on a fiscal year end
+    (see _is_fiscal_year_end, with year_end a known fiscal year end date)
+    """
+    if period == "quarterly":
+        return statements
+    if len(statements) < 4:
+        return []
+    fields = sorted({
+        key for statement in statements for key, value in statement.items()
+        if key not in STATEMENT_ID_KEYS and isinstance(value, (int, float)) and not isinstance(value, bool)
+    })
+    values = np.array([[statement.get(field) for field in fields] for statement in statements], dtype=float)
+    if statement_type in FLOW_STATEMENT_TYPES:
+        windows = np.lib.stride_tricks.sliding_window_view(values, 4, axis=0)
+        derived = windows.sum(axis=-1)
+        averaged = np.isin(fields, AVERAGED_FLOW_FIELDS)
+        derived[:, averaged] = windows[:, averaged].mean(axis=-1)
+    else:
+        derived = values[:len(statements) - 3]
+
+    # A window only counts when its four quarters are consecutive, about nine months
+    # between the report periods of its first and last quarter
+    ends = np.array([statement["report_period"] for statement in statements], dtype="datetime64[D]")
+    span = (ends[:-3] - ends[3:]).astype(int)
+    consecutive = (span > 250) & (span < 300)
+    results = []
+    for i in np.flatnonzero(consecutive).tolist():
+        if period == "annual" and not _is_fiscal_year_end(statements[i], year_end):
+            continue
+        record = {key: value for key, value in statements[i].items() if key not in fields}
+        record["period"] = period
+        record.update({field: None if np.isnan(value) else value for field, value in zip(fields, derived[i].tolist())})
+        results.append(record)
+    return results
+
+def get_statements(statement_type, ticker, period, limit, api_key):
+    """
+    The latest `limit` statements of one type and period for a ticker, derived from its
+    cached quarterly statements. The fiscal year end of annual statements comes from
+    the fiscal periods of the quarters or, without them, from the latest annual
+    statement. When no statement can be derived (e.g. semiannual filers or gaps in the
+    quarters), the statements of the period are fetched from the API directly
+    """
+    if period not in STATEMENT_PERIODS:
+        raise ValueError(f"Unsupported period: {period}, expected one of {', '.join(STATEMENT_PERIODS)}")
+    quarters = limit if period == "quarterly" else (4 * limit + 3 if period == "annual" else limit + 3)
+    statements = statement_store.get(statement_type, ticker, quarters, api_key)
+    year_end = None
+    if period == "annual" and len(statements) >= 4:
+        year_end = fiscal_year_end(statements) or statement_store.annual_report_period(statement_type, ticker, api_key)
+    derived = derive_statements(statements, statement_type, period, year_end)[:limit]
+    if derived or period == "quarterly":
+        return derived
+    print(f"No {period} {statement_type} statements derived for {ticker}, fetching them directly")
+    return fetch_statements(statement_type, ticker, period, limit, api_key)
+
+@lru_cache(maxsize=128)
+def compile_projection(fields):
+    """
+    Projection of statement records onto a tuple of line items (plus the keys that
+    identify a statement), built once per distinct tuple of fields and reused
+    """
+    keys = tuple(dict.fromkeys(STATEMENT_ID_KEYS + fields))
+
+    def project(records):
+        return [{key: record[key] for key in keys if key in record} for record in records]
+    return project
+
+def project_fields(records, fields):
+    """
+    Records reduced to the comma separated (or listed) fields, or unchanged without fields
+    """
+    if not fields:
+        return records
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    return compile_projection(tuple(field.strip() for field in fields if field.strip()))(records)
+
+def get_income_statements(ticker, period="ttm", limit=10, fields=None):
+    """
+    Get income statements for a ticker. This is one of the functions that is used to get the 
+    income statements based on the ticker specified by the user. Every period is derived
+    from the cached quarterly statements (see get_statements). With fields, every
+    statement is reduced to those line items
+    """
+    api_key = os.environ.get("FINANCIAL_DATASET_API")
+    if not api_key:
+        return {"error": "Missing FINANCIAL_DATASET_API environment variable"}
 
     try:
-        response = requests.get(url, headers={'X-API-Key': api_key})
-        return response.json()
+        return {"income_statements": project_fields(get_statements("income_statement", ticker, period, limit, api_key), fields)}
     except Exception as e:
         return {"ticker": ticker, "income_statements": [], "error": str(e)}
 
-def get_balance_sheets(ticker, period="ttm", limit=10):
+def get_balance_sheets(ticker, period="ttm", limit=10, fields=None):
     """
-    Get balance sheets for a ticker and the specified limit and time period
+    Get balance sheets for a ticker and the specified limit and time period, derived from
+    the cached quarterly balance sheets and optionally reduced to the given fields
     """
     api_key = os.environ.get("FINANCIAL_DATASET_API")
     print(f"Fetched the financial dataset API key: {api_key}")
     if not api_key:
         return {"error": "Missing FINANCIAL_DATASET_API environment variable"}
 
-    url = (
-        f'https://api.financialdatasets.ai/financials/balance-sheets'
-        f'?ticker={ticker}'
-        f'&period={period}'
-        f'&limit={limit}'
-    )
-
     try:
-        response = requests.get(url, headers={'X-API-Key': api_key})
-        return response.json()
+        return {"balance_sheets": project_fields(get_statements("balance_sheet", ticker, period, limit, api_key), fields)}
     except Exception as e:
         return {"ticker": ticker, "balance_sheets": [], "error": str(e)}
 
-def get_cash_flow_statements(ticker, period="ttm", limit=10):
+def get_cash_flow_statements(ticker, period="ttm", limit=10, fields=None):
     """
-    Get cash flow statements for a ticker
+    Get cash flow statements for a ticker, derived from the cached quarterly statements
+    and optionally reduced to the given fields
     """
     api_key = os.environ.get("FINANCIAL_DATASET_API")
     print(f"Fetched the financial dataset API key: {api_key}")
     if not api_key:
         return {"error": "Missing FINANCIAL_DATASET_API environment variable"}
 
-    url = (
-        f'https://api.financialdatasets.ai/financials/cash-flow-statements'
-        f'?ticker={ticker}'
-        f'&period={period}'
-        f'&limit={limit}'
-    )
-
     try:
-        response = requests.get(url, headers={'X-API-Key': api_key})
-        return response.json()
+        return {"cash_flow_statements": project_fields(get_statements("cash_flow_statement", ticker, period, limit, api_key), fields)}
     except Exception as e:
         return {"ticker": ticker, "cash_flow_statements": [], "error": str(e)}
 
+def parse_statement_types(statements):
+    """
+    Statement types from a comma separated string or a list such as "income,balance";
+    all three when none are given
+    """
+    if not statements:
+        return list(STATEMENT_TYPES)
+    if isinstance(statements, str):
+        statements = statements.split(",")
+    types = []
+    for statement in statements:
+        name = statement.strip().lower()
+        name = STATEMENT_ALIASES.get(name, name)
+        if name not in STATEMENT_TYPES:
+            raise ValueError(f"Unsupported statement type: {statement.strip()}")
+        if name not in types:
+            types.append(name)
+    return types
+
+def merge_statements_by_period(statements_by_type):
+    """
+    Align statements of several types on their report period: one record per period,
+    newest first, holding the line items of every statement type for that period
+    """
+    merged = {}
+    for statement_type, statements in statements_by_type.items():
+        for statement in statements:
+            record = merged.setdefault(statement["report_period"], {
+                key: statement[key] for key in STATEMENT_ID_KEYS if key in statement
+            })
+            record[statement_type] = {key: value for key, value in statement.items() if key not in STATEMENT_ID_KEYS}
+    return [merged[report_period] for report_period in sorted(merged, reverse=True)]
+
+def get_financial_statements(ticker, period="ttm", limit=10, statements=None):
+    """
+    Get any subset of the income statements, balance sheets and cash flow statements
+    of a ticker in one call. The statement types are fetched concurrently on the pooled
+    session and merged by report period into a single aligned result
+    """
+    api_key = os.environ.get("FINANCIAL_DATASET_API")
+    if not api_key:
+        return {"error": "Missing FINANCIAL_DATASET_API environment variable"}
+    try:
+        statement_types = parse_statement_types(statements)
+    except ValueError as e:
+        return {"error": str(e), "supported_statements": list(STATEMENT_TYPES)}
+
+    def fetch(statement_type):
+        try:
+            return get_statements(statement_type, ticker, period, limit, api_key)
+        except Exception as e:
+            print(f"Error fetching {statement_type} for {ticker}: {e}")
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(statement_types)) as executor:
+        fetched = dict(zip(statement_types, executor.map(fetch, statement_types)))
+    errors = {statement_type: str(result) for statement_type, result in fetched.items() if isinstance(result, Exception)}
+    result = {
+        "ticker": ticker,
+        "period": period,
+        "statements": merge_statements_by_period({
+            statement_type: statements for statement_type, statements in fetched.items()
+            if not isinstance(statements, Exception)
+        })
+    }
+    if errors:
+        result["errors"] = errors
+    return result
+
+def parse_tickers(tickers):
+    """
+    Unique upper case tickers from a list or a comma separated string, in order
+    """
+    if isinstance(tickers, str):
+        tickers = tickers.split(",")
+    return list(dict.fromkeys(ticker.strip().upper() for ticker in tickers if ticker.strip()))
+
+def statement_arrays(statements_by_ticker, length):
+    """
+    Turn merged statements (see merge_statements_by_period) of several tickers into one
+    2-D float array per line item in RATIO_FIELDS, with a row per ticker and a column
+    per period (newest first). Missing values and periods are NaN
+    """
+    arrays = {
+        field: np.full((len(statements_by_ticker), length), np.nan)
+        for fields in RATIO_FIELDS.values() for field in fields
+    }
+    for row, statements in enumerate(statements_by_ticker):
+        for column, record in enumerate(statements[:length]):
+            for statement_type, fields in RATIO_FIELDS.items():
+                items = record.get(statement_type, {})
+                for field in fields:
+                    value = items.get(field)
+                    if value is not None:
+                        arrays[field][row, column] = value
+    return arrays
+
+def _growth(values):
+    """
+    Period-over-period growth along the last axis of arrays ordered newest first,
+    relative to the absolute prior value. The oldest period has no growth (NaN)
+    """
+    growth = np.full(values.shape, np.nan)
+    prior = values[..., 1:]
+    growth[..., :-1] = (values[..., :-1] - prior) / np.abs(prior)
+    return growth
+
+def compute_ratios(a):
+    """
+    Standard financial ratios from the line item arrays of statement_arrays, computed
+    element-wise for every ticker and period at once
+    """
+    free_cash_flow = np.where(np.isnan(a["free_cash_flow"]),
+                              a["net_cash_flow_from_operations"] + a["capital_expenditure"], a["free_cash_flow"])
+    pretax_income = a["net_income"] + a["income_tax_expense"]
+    tax_rate = np.clip(np.where(pretax_income > 0, a["income_tax_expense"] / pretax_income, 0), 0, 1)
+    invested_capital = a["total_debt"] + a["shareholders_equity"] - a["cash_and_equivalents"]
+    return {
+        "gross_margin": a["gross_profit"] / a["revenue"],
+        "operating_margin": a["operating_income"] / a["revenue"],
+        "net_margin": a["net_income"] / a["revenue"],
+        "return_on_equity": a["net_income"] / a["shareholders_equity"],
+        "return_on_assets": a["net_income"] / a["total_assets"],
+        "return_on_invested_capital": a["operating_income"] * (1 - tax_rate) / invested_capital,
+        "debt_to_equity": a["total_debt"] / a["shareholders_equity"],
+        "liabilities_to_assets": a["total_liabilities"] / a["total_assets"],
+        "interest_coverage": a["operating_income"] / a["interest_expense"],
+        "current_ratio": a["current_assets"] / a["current_liabilities"],
+        "quick_ratio": (a["current_assets"] - np.nan_to_num(a["inventory"])) / a["current_liabilities"],
+        "cash_ratio": a["cash_and_equivalents"] / a["current_liabilities"],
+        "free_cash_flow": free_cash_flow,
+        "free_cash_flow_margin": free_cash_flow / a["revenue"],
+        "revenue_growth": _growth(a["revenue"]),
+        "net_income_growth": _growth(a["net_income"]),
+        "eps_growth": _growth(a["earnings_per_share"]),
+        "free_cash_flow_growth": _growth(free_cash_flow),
+    }
+
+def _to_list(values, decimals=4):
+    """
+    Rounded values as a JSON friendly list, with None for missing or infinite values
+    """
+    return [round(value, decimals) if np.isfinite(value) else None for value in values.tolist()]
+
+def get_financial_ratios(tickers, period="annual", limit=5):
+    """
+    Get margins, returns (ROE, ROA, ROIC), leverage, liquidity ratios, free cash flow
+    and period-over-period growth for one or several tickers. The statements of every
+    ticker are fetched concurrently and turned into aligned arrays, so the ratios of
+    all tickers and periods are computed at once. Returns one compact table per ticker
+    """
+    tickers = parse_tickers(tickers)
+    if not tickers:
+        return {"error": "No tickers provided"}
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(tickers))) as executor:
+        fetched = list(executor.map(lambda ticker: get_financial_statements(ticker, period, limit), tickers))
+    errors = {}
+    statements_by_ticker = {}
+    for ticker, response in zip(tickers, fetched):
+        if response.get("statements"):
+            statements_by_ticker[ticker] = response["statements"]
+        else:
+            errors[ticker] = response.get("errors") or response.get("error") or "No statements found"
+    result = {"period": period}
+    if statements_by_ticker:
+        length = max(len(statements) for statements in statements_by_ticker.values())
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = compute_ratios(statement_arrays(list(statements_by_ticker.values()), length))
+        result["tickers"] = {}
+        for row, (ticker, statements) in enumerate(statements_by_ticker.items()):
+            count = len(statements)
+            result["tickers"][ticker] = {
+                "report_period": [record["report_period"] for record in statements],
+                **{name: _to_list(values[row, :count]) for name, values in ratios.items()}
+            }
+    if errors:
+        result["errors"] = errors
+    return result
+
+def compare_peers(tickers, statements="balance", period="annual", limit=4, fields=None,
+                  deadline=PEER_DEADLINE_SECONDS):
+    """
+    Compare the statements of several companies side by side. Every ticker and
+    statement type is one job on a worker pool bounded by MAX_WORKERS, which matches the
+    connection pool of the shared session. Jobs still running at the deadline are
+    abandoned and their tickers reported as pending, so the comparison returns with
+    partial results instead of waiting on slow fetches, and their requests time out at
+    the deadline so that they do not hold request slots after it. Periods are aligned by position
+    (latest first), since companies may have different fiscal years; each line item
+    maps every ticker to its values, limited to `fields` when given
+    """
+    api_key = os.environ.get("FINANCIAL_DATASET_API")
+    if not api_key:
+        return {"error": "Missing FINANCIAL_DATASET_API environment variable"}
+    tickers = parse_tickers(tickers)
+    if not tickers:
+        return {"error": "No tickers provided"}
+    if len(tickers) > MAX_PEER_TICKERS:
+        return {"error": f"At most {MAX_PEER_TICKERS} tickers can be compared at once"}
+    try:
+        statement_types = parse_statement_types(statements)
+    except ValueError as e:
+        return {"error": str(e), "supported_statements": list(STATEMENT_TYPES)}
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+
+    expires = time.monotonic() + deadline
+
+    def fetch(statement_type, ticker):
+        request_deadline.at = expires
+        try:
+            return get_statements(statement_type, ticker, period, limit, api_key)
+        finally:
+            request_deadline.at = None
+
+    executor = ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(tickers) * len(statement_types)))
+    jobs = {
+        executor.submit(fetch, statement_type, ticker): (ticker, statement_type)
+        for ticker in tickers for statement_type in statement_types
+    }
+    done, not_done = wait(jobs, timeout=deadline)
+    # Do not wait for the pending fetches; their requests time out at the deadline
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    fetched = {}
+    errors = {}
+    for job in done:
+        ticker, statement_type = jobs[job]
+        try:
+            fetched[(ticker, statement_type)] = job.result()
+        except Exception as e:
+            errors.setdefault(ticker, {})[statement_type] = str(e)
+    pending = [ticker for ticker in tickers if any(jobs[job][0] == ticker for job in not_done)]
+    completed = [ticker for ticker in tickers if ticker not in pending and ticker not in errors]
+
+    result = {"period": period, "tickers": completed, "report_periods": {}, "statements": {}}
+    for statement_type in statement_types:
+        table = {}
+        for ticker in completed:
+            records = fetched[(ticker, statement_type)]
+            result["report_periods"].setdefault(ticker, [record["report_period"] for record in records])
+            if not records:
+                continue
+            names = fields or [
+                key for key, value in records[0].items() if key not in STATEMENT_ID_KEYS and not isinstance(value, str)
+            ]
+            for name in names:
+                if any(name in record for record in records):
+                    table.setdefault(name, {})[ticker] = [record.get(name) for record in records]
+        result["statements"][statement_type] = table
+    if pending:
+        print(f"Peer comparison deadline of {deadline}s reached, pending: {pending}")
+        result["pending"] = pending
+    if errors:
+        result["errors"] = errors
+    return result
+
+def fetch_price(ticker, api_key):
+    """
+    Latest price of a ticker from the price snapshot, or None when it is not available
+    """
+    try:
+        response = api_get(
+            f"https://api.financialdatasets.ai/prices/snapshot?ticker={ticker}", headers={'X-API-Key': api_key})
+        return response.json().get("snapshot", {}).get("price")
+    except Exception as e:
+        print(f"Error fetching the price of {ticker}: {e}")
+        return None
+
+def build_factor_table(tickers, period="ttm", periods=FACTOR_TABLE_PERIODS):
+    """
+    Batch job building the screener's factor table: the statements and latest price of
+    every ticker are fetched on the bounded worker pool, turned into ticker-by-period
+    arrays and every ratio of compute_ratios plus market cap, free cash flow yield and
+    earnings yield (latest period only) is stored as one column. The table is saved as
+    an .npz file and uploaded to FACTOR_TABLE_S3_URI when it is set
+    """
+    api_key = os.environ.get("FINANCIAL_DATASET_API")
+    if not api_key:
+        return {"error": "Missing FINANCIAL_DATASET_API environment variable"}
+    tickers = parse_tickers(tickers)
+    if not tickers:
+        return {"error": "No tickers provided"}
+    started = time.time()
+
+    def fetch(ticker):
+        try:
+            statements = merge_statements_by_period({
+                statement_type: get_statements(statement_type, ticker, period, periods, api_key)
+                for statement_type in STATEMENT_TYPES
+            })
+            return statements, fetch_price(ticker, api_key)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        fetched = list(executor.map(fetch, tickers))
+    errors = {ticker: str(result) for ticker, result in zip(tickers, fetched) if isinstance(result, Exception)}
+    rows = [(ticker, result) for ticker, result in zip(tickers, fetched) if not isinstance(result, Exception) and result[0]]
+    errors.update({ticker: "No statements found" for ticker, result in zip(tickers, fetched)
+                   if not isinstance(result, Exception) and not result[0]})
+    if not rows:
+        return {"error": "No statements found for any ticker", "errors": errors}
+
+    statements_by_ticker = [statements[:periods] for _, (statements, _) in rows]
+    arrays = statement_arrays(statements_by_ticker, periods)
+    prices = np.array([price for _, (_, price) in rows], dtype=float)
+    shares = np.array([
+        next((record.get("balance_sheet", {}).get("outstanding_shares") for record in statements
+              if record.get("balance_sheet", {}).get("outstanding_shares")), None)
+        for statements in statements_by_ticker
+    ], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factors = compute_ratios(arrays)
+        market_cap = np.full((len(rows), periods), np.nan)
+        market_cap[:, 0] = prices * shares
+        factors.update({
+            "revenue": arrays["revenue"],
+            "net_income": arrays["net_income"],
+            "market_cap": market_cap,
+            "free_cash_flow_yield": factors["free_cash_flow"] / market_cap,
+            "earnings_yield": arrays["net_income"] / market_cap,
+        })
+    report_periods = np.array([
+        [record["report_period"] for record in statements] + [""] * (periods - len(statements))
+        for statements in statements_by_ticker
+    ])
+    os.makedirs(os.path.dirname(FACTOR_TABLE_PATH) or ".", exist_ok=True)
+    with open(FACTOR_TABLE_PATH, "wb") as f:
+        np.savez(f, tickers=np.array([ticker for ticker, _ in rows]), report_periods=report_periods,
+                 period=np.array(period), built_at=np.array(time.time()),
+                 **{f"factor_{name}": values for name, values in factors.items()})
+    if FACTOR_TABLE_S3_URI:
+        bucket, _, key = FACTOR_TABLE_S3_URI[len("s3://"):].partition("/")
+        boto3.client("s3").upload_file(FACTOR_TABLE_PATH, bucket, key)
+    print(f"Built the factor table of {len(rows)} tickers in {time.time() - started:.1f}s")
+    result = {"tickers": len(rows), "factors": list(factors), "period": period, "path": FACTOR_TABLE_PATH}
+    if errors:
+        result["errors"] = errors
+    return result
+
+class FactorTable:
+    """
+    The screener's columnar factor table: a ticker array, a ticker-by-period array of
+    report periods and one ticker-by-period float array per factor. Loaded from the
+    local file and kept in memory until the file changes. With FACTOR_TABLE_S3_URI, the
+    ETag of the S3 object is checked at most every FACTOR_TABLE_CHECK_SECONDS and the
+    local copy is downloaded again whenever the table was rebuilt
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._etag = None
+        self._checked_at = 0.0
+
+    def _sync_from_s3(self):
+        bucket, _, key = FACTOR_TABLE_S3_URI[len("s3://"):].partition("/")
+        s3 = boto3.client("s3")
+        try:
+            etag = s3.head_object(Bucket=bucket, Key=key)["ETag"]
+        except Exception as e:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"No factor table at {FACTOR_TABLE_S3_URI}: {e}") from e
+            print(f"Could not check the factor table in S3, using the local copy: {e}")
+            return
+        if etag != self._etag or not os.path.exists(self.path):
+            print(f"Downloading the factor table from {FACTOR_TABLE_S3_URI} (ETag {etag})")
+            tmp_path = f"{self.path}.download"
+            s3.download_file(bucket, key, tmp_path)
+            os.replace(tmp_path, self.path)
+            self._etag = etag
+        self._checked_at = time.time()
+
+    def load(self):
+        if FACTOR_TABLE_S3_URI and (time.time() - self._checked_at >= FACTOR_TABLE_CHECK_SECONDS
+                                    or not os.path.exists(self.path)):
+            self._sync_from_s3()
+        mtime = os.path.getmtime(self.path)
+        if mtime != self._mtime:
+            with np.load(self.path) as data:
+                self.tickers = data["tickers"]
+                self.report_periods = data["report_periods"]
+                self.period = str(data["period"])
+                self.built_at = float(data["built_at"])
+                self.factors = {name[len("factor_"):]: data[name] for name in data.files if name.startswith("factor_")}
+            self._mtime = mtime
+        return self
+
+factor_table = FactorTable(FACTOR_TABLE_PATH)
+
+def _percentile_ranks(values):
+    """
+    Rank of every value among the others as a fraction from 0 (lowest) to 1 (highest).
+    Equal values share the average of the ranks they span, so that ties score the same
+    """
+    values = np.asarray(values)
+    if not len(values):
+        return np.empty(0)
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_values[1:] != sorted_values[:-1])))
+    sizes = np.diff(np.append(starts, len(values)))
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(starts + (sizes - 1) / 2, sizes)
+    return ranks / max(len(values) - 1, 1)
+
+def screen_stocks(sort_by, filters=None, top_k=DEFAULT_SCREEN_TOP_K, period_index=0):
+    """
+    Rank the tickers of the factor table without any upstream call. `filters` is a
+    comma separated list of conditions such as "debt_to_equity<1,current_ratio>=1.5",
+    applied as vectorized masks. `sort_by` is a factor (highest first; prefix it with
+    "-" for lowest first) or several of them, in which case tickers are ranked by the
+    mean of their percentile ranks on each. The top k are selected with argpartition
+    """
+    try:
+        table = factor_table.load()
+    except OSError:
+        return {"error": "The factor table has not been built yet, run the build_factor_table job first"}
+    if not 0 <= period_index < table.report_periods.shape[1]:
+        return {"error": f"Period index must be between 0 and {table.report_periods.shape[1] - 1}"}
+    top_k = min(max(int(top_k), 1), MAX_SCREEN_TOP_K)
+
+    mask = np.ones(len(table.tickers), dtype=bool)
+    conditions = [condition for condition in (filters or "").split(",") if condition.strip()]
+    filter_names = []
+    for condition in conditions:
+        match = SCREEN_FILTER_PATTERN.match(condition)
+        if not match or match.group(1).lower() not in table.factors:
+            return {"error": f"Invalid filter: {condition.strip()}", "factors": sorted(table.factors)}
+        name, operator, threshold = match.group(1).lower(), match.group(2), float(match.group(3))
+        values = table.factors[name][:, period_index]
+        with np.errstate(invalid="ignore"):
+            mask &= {
+                "<": values < threshold, "<=": values <= threshold, ">": values > threshold,
+                ">=": values >= threshold, "=": values == threshold, "==": values == threshold
+            }[operator]
+        filter_names.append(name)
+
+    keys = [key.strip().lower() for key in sort_by.split(",") if key.strip()]
+    names = [key.lstrip("-") for key in keys]
+    unknown = [name for name in names if name not in table.factors]
+    if not keys or unknown:
+        return {"error": f"Unknown factor to sort by: {', '.join(unknown) or sort_by}", "factors": sorted(table.factors)}
+    columns = np.stack([
+        -table.factors[name][:, period_index] if key.startswith("-") else table.factors[name][:, period_index]
+        for key, name in zip(keys, names)
+    ])
+    mask &= np.all(np.isfinite(columns), axis=0)
+    candidates = np.flatnonzero(mask)
+    if len(keys) == 1:
+        scores = columns[0, candidates]
+    else:
+        scores = np.mean([_percentile_ranks(column[candidates]) for column in columns], axis=0)
+    k = min(top_k, len(candidates))
+    top = np.argpartition(-scores, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+    top = top[np.argsort(-scores[top], kind="stable")]
+    rows = candidates[top]
+
+    result = {
+        "period": table.period,
+        "built_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(table.built_at)),
+        "universe": len(table.tickers),
+        "matches": len(candidates),
+        "tickers": table.tickers[rows].tolist(),
+        "report_period": table.report_periods[rows, period_index].tolist(),
+    }
+    if len(keys) > 1:
+        result["score"] = _to_list(scores[top])
+    for name in dict.fromkeys(names + filter_names):
+        result[name] = _to_list(table.factors[name][rows, period_index])
+    return result
+
+def dcf_values(revenue, growth, margin, discount_rate, terminal_growth, years):
+    """
+    Enterprise value of every scenario (all arguments but revenue and years are arrays
+    with one value per scenario, or broadcastable to them). Revenue growth fades
+    linearly from the scenario growth to the terminal growth over the forecast years,
+    free cash flow is revenue times the margin, and the terminal value is a Gordon
+    growth value of the last year's free cash flow
+    """
+    fade = np.arange(1, years + 1) / years
+    growth_path = growth[..., None] * (1 - fade) + terminal_growth[..., None] * fade
+    revenues = revenue * np.cumprod(1 + growth_path, axis=-1)
+    free_cash_flows = revenues * margin[..., None]
+    discount = (1 + discount_rate[..., None]) ** np.arange(1, years + 1)
+    terminal_value = free_cash_flows[..., -1] * (1 + terminal_growth) / (discount_rate - terminal_growth)
+    return (free_cash_flows / discount).sum(axis=-1) + terminal_value / discount[..., -1]
+
+def get_dcf_valuation(ticker, simulations=DCF_DEFAULT_SIMULATIONS, years=DCF_DEFAULT_YEARS,
+                      discount_rate=DCF_DEFAULT_DISCOUNT_RATE, terminal_growth=DCF_DEFAULT_TERMINAL_GROWTH,
+                      seed=None):
+    """
+    Monte Carlo discounted cash flow valuation of a company. Revenue growth and free
+    cash flow margin scenarios are drawn from normal distributions fitted to the last
+    DCF_HISTORY_YEARS annual statements, and discount rate and terminal growth around
+    the given values. Scenarios are valued in chunks of DCF_CHUNK_SIZE so memory stays
+    bounded; a seed makes the draws reproducible. Returns intrinsic value per share
+    percentiles, the probability of exceeding the current price and a sensitivity grid
+    of value per share over discount rates and terminal growth rates
+    """
+    api_key = os.environ.get("FINANCIAL_DATASET_API")
+    if not api_key:
+        return {"error": "Missing FINANCIAL_DATASET_API environment variable"}
+    simulations = min(max(int(simulations), 1), DCF_MAX_SIMULATIONS)
+    if years < 1:
+        return {"error": "The forecast must cover at least one year"}
+    if discount_rate - terminal_growth < DCF_MIN_RATE_SPREAD:
+        return {"error": f"The discount rate must exceed the terminal growth by at least {DCF_MIN_RATE_SPREAD}"}
+    try:
+        income = get_statements("income_statement", ticker, "annual", DCF_HISTORY_YEARS, api_key)
+        cash_flow = get_statements("cash_flow_statement", ticker, "annual", DCF_HISTORY_YEARS, api_key)
+        balance = get_statements("balance_sheet", ticker, "quarterly", 1, api_key)
+    except Exception as e:
+        return {"ticker": ticker, "error": str(e)}
+
+    history = merge_statements_by_period({"income_statement": income, "cash_flow_statement": cash_flow})
+    arrays = statement_arrays([history], len(history))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = compute_ratios(arrays)
+    revenue = arrays["revenue"][0]
+    margins = ratios["free_cash_flow_margin"][0]
+    growths = ratios["revenue_growth"][0]
+    margins = margins[np.isfinite(margins)]
+    growths = growths[np.isfinite(growths)]
+    if not len(margins) or not np.isfinite(revenue[0]) or not balance:
+        return {"ticker": ticker, "error": "Not enough annual revenue and free cash flow history for a DCF valuation"}
+    latest = balance[0]
+    shares = latest.get("outstanding_shares")
+    if not shares:
+        return {"ticker": ticker, "error": "The number of outstanding shares is not available"}
+    net_cash = (latest.get("cash_and_equivalents") or 0) - (latest.get("total_debt") or 0)
+
+    growth_mean = float(np.clip(growths.mean(), *DCF_GROWTH_BOUNDS)) if len(growths) else terminal_growth
+    growth_std = float(growths.std(ddof=1)) if len(growths) > 1 else abs(growth_mean) / 2
+    margin_mean = float(margins.mean())
+    margin_std = float(margins.std(ddof=1)) if len(margins) > 1 else abs(margin_mean) / 4
+
+    rng = np.random.default_rng(seed)
+    values = np.empty(simulations)
+    for begin in range(0, simulations, DCF_CHUNK_SIZE):
+        size = min(DCF_CHUNK_SIZE, simulations - begin)
+        scenario_terminal = rng.normal(terminal_growth, DCF_TERMINAL_GROWTH_STD, size)
+        scenario_rate = np.maximum(rng.normal(discount_rate, DCF_DISCOUNT_RATE_STD, size),
+                                   scenario_terminal + DCF_MIN_RATE_SPREAD)
+        enterprise = dcf_values(revenue[0], rng.normal(growth_mean, growth_std, size),
+                                rng.normal(margin_mean, margin_std, size), scenario_rate, scenario_terminal, years)
+        values[begin:begin + size] = (enterprise + net_cash) / shares
+
+    rates = discount_rate + np.array([-0.02, -0.01, 0.0, 0.01, 0.02])
+    terminals = terminal_growth + np.array([-0.01, -0.005, 0.0, 0.005, 0.01])
+    rate_grid, terminal_grid = np.meshgrid(rates, terminals, indexing="ij")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grid = (dcf_values(revenue[0], np.full(rate_grid.shape, growth_mean), np.full(rate_grid.shape, margin_mean),
+                           rate_grid, terminal_grid, years) + net_cash) / shares
+    grid = np.where(rate_grid - terminal_grid >= DCF_MIN_RATE_SPREAD, grid, np.nan)
+
+    result = {
+        "ticker": ticker,
+        "report_period": history[0]["report_period"],
+        "simulations": simulations,
+        "seed": seed,
+        "years": years,
+        "assumptions": {
+            "revenue": revenue[0],
+            "revenue_growth": {"mean": round(growth_mean, 4), "std": round(growth_std, 4)},
+            "free_cash_flow_margin": {"mean": round(margin_mean, 4), "std": round(margin_std, 4)},
+            "discount_rate": {"mean": discount_rate, "std": DCF_DISCOUNT_RATE_STD},
+            "terminal_growth": {"mean": terminal_growth, "std": DCF_TERMINAL_GROWTH_STD},
+            "net_cash": net_cash,
+            "outstanding_shares": shares
+        },
+        "value_per_share": dict(zip([f"p{p}" for p in DCF_PERCENTILES], _to_list(np.percentile(values, DCF_PERCENTILES), 2))),
+        "mean_value_per_share": round(float(values.mean()), 2),
+        "sensitivity": {
+            "discount_rate": _to_list(rates),
+            "terminal_growth": _to_list(terminals),
+            "value_per_share": [_to_list(row, 2) for row in grid]
+        }
+    }
+    price = fetch_price(ticker, api_key)
+    if price:
+        result["price"] = price
+        result["probability_above_price"] = round(float((values > price).mean()), 4)
+    return result
+
 def populate_function_response(event, response_body):
     return {
         'response': {
@@ -95,6 +1059,12 @@ def populate_function_response(event, response_body):
     }
 
 def lambda_handler(event, context):
+    # Scheduled batch job (e.g. an EventBridge rule with the input
+    # {"job": "build_factor_table", "tickers": "AAPL,MSFT,..."}) rather than an agent call
+    if event.get('job') == 'build_factor_table':
+        return build_factor_table(event['tickers'], event.get('period', 'ttm'),
+                                  int(event.get('periods', FACTOR_TABLE_PERIODS)))
+
     # get the action group used during the invocation of the lambda function
     actionGroup = event.get('actionGroup', '')
     print(f"Action Group: {actionGroup}")
@@ -109,33 +1079,97 @@ def lambda_handler(event, context):
             ticker = get_named_parameter(event, "ticker")
             period = get_named_parameter(event, "period")
             limit = int(get_named_parameter(event, "limit"))
+            fields = get_optional_parameter(event, "fields")
             
             if not all([ticker, period, limit]):
                 result = 'Missing required parameters'
             else:
-                response = get_income_statements(ticker, period, limit)
+                response = get_income_statements(ticker, period, limit, fields)
                 result = response
 
         elif function == 'get_balance_sheets':
             ticker = get_named_parameter(event, "ticker")
             period = get_named_parameter(event, "period")
             limit = int(get_named_parameter(event, "limit"))
+            fields = get_optional_parameter(event, "fields")
             
             if not all([ticker, period, limit]):
                 result = 'Missing required parameters'
             else:
-                response = get_balance_sheets(ticker, period, limit)
+                response = get_balance_sheets(ticker, period, limit, fields)
                 result = response
 
         elif function == 'get_cash_flow_statements':
             ticker = get_named_parameter(event, "ticker")
             period = get_named_parameter(event, "period")
             limit = int(get_named_parameter(event, "limit"))
+            fields = get_optional_parameter(event, "fields")
             
             if not all([ticker, period, limit]):
                 result = 'Missing required parameters'
             else:
-                response = get_cash_flow_statements(ticker, period, limit)
+                response = get_cash_flow_statements(ticker, period, limit, fields)
+                result = response
+
+        elif function == 'get_financial_statements':
+            ticker = get_named_parameter(event, "ticker")
+            period = get_named_parameter(event, "period")
+            limit = int(get_named_parameter(event, "limit"))
+            statements = get_optional_parameter(event, "statements")
+
+            if not all([ticker, period, limit]):
+                result = 'Missing required parameters'
+            else:
+                response = get_financial_statements(ticker, period, limit, statements)
+                result = response
+
+        elif function == 'get_financial_ratios':
+            tickers = get_named_parameter(event, "tickers")
+            period = get_optional_parameter(event, "period", "annual")
+            limit = int(get_optional_parameter(event, "limit", 5))
+
+            if not tickers:
+                result = 'Missing required parameter: tickers'
+            else:
+                response = get_financial_ratios(tickers, period, limit)
+                result = response
+
+        elif function == 'compare_peers':
+            tickers = get_named_parameter(event, "tickers")
+            statements = get_optional_parameter(event, "statements", "balance")
+            period = get_optional_parameter(event, "period", "annual")
+            limit = int(get_optional_parameter(event, "limit", 4))
+            fields = get_optional_parameter(event, "fields")
+
+            if not tickers:
+                result = 'Missing required parameter: tickers'
+            else:
+                response = compare_peers(tickers, statements, period, limit, fields)
+                result = response
+
+        elif function == 'screen_stocks':
+            sort_by = get_named_parameter(event, "sort_by")
+            filters = get_optional_parameter(event, "filters")
+            top_k = int(get_optional_parameter(event, "top_k", DEFAULT_SCREEN_TOP_K))
+
+            if not sort_by:
+                result = 'Missing required parameter: sort_by'
+            else:
+                response = screen_stocks(sort_by, filters, top_k)
+                result = response
+
+        elif function == 'get_dcf_valuation':
+            ticker = get_named_parameter(event, "ticker")
+            discount_rate = float(get_optional_parameter(event, "discount_rate", DCF_DEFAULT_DISCOUNT_RATE))
+            terminal_growth = float(get_optional_parameter(event, "terminal_growth", DCF_DEFAULT_TERMINAL_GROWTH))
+            years = int(get_optional_parameter(event, "years", DCF_DEFAULT_YEARS))
+            seed = get_optional_parameter(event, "seed")
+
+            if not ticker:
+                result = 'Missing required parameter: ticker'
+            else:
+                response = get_dcf_valuation(ticker, DCF_DEFAULT_SIMULATIONS, years, discount_rate, terminal_growth,
+                                             int(seed) if seed else None)
                 result = response
 
         else:
@@ -1,23 +1,183 @@
 import os
+import re
 import json
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, Union, Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import reduce
+from itertools import product
+from statistics import NormalDist
+from threading import BoundedSemaphore
+from typing import Optional, Union, Dict, List, Tuple
 
 # Import the requests library from the lambda layer
 import sys
 sys.path.append("/opt/python/lib/python3.9/site-packages/")
 
 # Import the libraries that are attached to the lambda via the lambda
-# layer: ta, requests, pandas
+# layer: requests, numpy
 import requests
+import numpy as np
+from requests.adapters import HTTPAdapter
+
+# Milliseconds in a day, used for date arithmetic on epoch millisecond bar times
+MS_PER_DAY: int = 24 * 60 * 60 * 1000
+
+# Long price histories are fetched as windows of PRICE_FETCH_CHUNK_DAYS calendar days,
+# downloaded concurrently by up to PRICE_FETCH_MAX_WORKERS threads. The API returns at
+# most PRICE_FETCH_LIMIT rows per request
+PRICE_FETCH_CHUNK_DAYS: Dict[str, int] = {"day": 365, "minute": 7}
+PRICE_FETCH_MAX_WORKERS: int = 8
+PRICE_FETCH_LIMIT: int = 5000
+# Seconds a request to the API may take to connect or to send data before it is given up
+API_TIMEOUT_SECONDS: float = float(os.environ.get("API_TIMEOUT_SECONDS", 10))
+
+# Where the price bar store keeps its file tier unless PRICE_STORE_DIR is set
+DEFAULT_PRICE_STORE_DIR: str = "/tmp/price_store"
+
+# Bar intervals the agent may ask for. Daily and minute bars are fetched from the API
+# as base bars; coarser intervals (weeks, months, N days, N minutes, hours) are built
+# locally from them. The most trading sessions one bar can span is used to size
+# warm-up windows
+DEFAULT_INTERVAL: str = "day"
+INTERVAL_UNITS: Dict[str, str] = {
+    "min": "minute", "minute": "minute", "hour": "hour", "hourly": "hour",
+    "day": "day", "daily": "day", "week": "week", "weekly": "week", "month": "month", "monthly": "month"
+}
+SESSIONS_PER_BAR: Dict[str, float] = {"minute": 1 / 390, "hour": 1 / 6.5, "day": 1, "week": 5, "month": 23}
+
+# The offline NYSE trading calendar covers these years. Besides the regular holiday
+# rules, the exchange closed on the following days
+CALENDAR_FIRST_YEAR: int = 1990
+CALENDAR_LAST_YEAR: int = 2060
+NYSE_SPECIAL_CLOSURES: Tuple[str, ...] = (
+    "1994-04-27", "2001-09-11", "2001-09-12", "2001-09-13", "2001-09-14", "2004-06-11",
+    "2007-01-02", "2012-10-29", "2012-10-30", "2018-12-05", "2025-01-09"
+)
+
+# EMA, RSI and MACD are recursive, so their first values depend on where the series
+# starts. They are warmed up over this many periods before the first requested bar,
+# which leaves less than 1% of the starting value in the results
+INDICATOR_WARMUP_PERIODS: int = 5
+
+# Output formats of get_stock_prices and get_technical_indicators: one record per bar,
+# parallel arrays with time strings, or parallel arrays with epoch-delta timestamps.
+# Values in the columnar formats are rounded to COLUMNAR_DECIMALS decimals
+OUTPUT_FORMATS: Tuple[str, ...] = ("rows", "columnar", "columnar_delta")
+DEFAULT_OUTPUT_FORMAT: str = "rows"
+COLUMNAR_DECIMALS: int = 4
+
+# Long series can be downsampled to a point or byte budget before they are returned,
+# with Largest-Triangle-Three-Buckets or a min/max envelope. The most recent points
+# are always kept at full resolution
+DOWNSAMPLE_METHODS: Tuple[str, ...] = ("lttb", "minmax")
+DOWNSAMPLE_RECENT_POINTS: int = 20
+
+# Byte budget of a series returned to the agent by the lambda handler, kept under the
+# action group response size limit. The handler always applies it, so long series are
+# downsampled by default (a year of daily rows is about 110 bars). Set
+# RESPONSE_MAX_BYTES to 0 to disable it
+RESPONSE_MAX_BYTES: Optional[int] = int(os.environ.get("RESPONSE_MAX_BYTES", 20000)) or None
+
+# Trading sessions in a year, used to annualize volatility and for the 52-week range,
+# and the relative opening gap counted as a gap up or down in price summaries
+TRADING_DAYS_PER_YEAR: int = 252
+GAP_THRESHOLD: float = 0.01
+
+# Price levels: bars on each side of a swing high or low, the relative distance
+# within which swing points are clustered into one level, how many levels are
+# returned and how many recent bars are checked for level breakouts
+DEFAULT_SWING_WINDOW: int = 5
+DEFAULT_LEVEL_TOLERANCE: float = 0.015
+DEFAULT_MAX_LEVELS: int = 8
+BREAKOUT_LOOKBACK_BARS: int = 5
+
+# Cross-ticker risk: default benchmark, rolling window (about a quarter of trading
+# days) and annual risk-free rate used for the Sharpe ratio
+DEFAULT_BENCHMARK: str = "SPY"
+DEFAULT_RISK_WINDOW: int = 63
+DEFAULT_RISK_FREE_RATE: float = 0.0
+
+# Portfolio VaR/CVaR defaults: confidence level, horizon in trading days, trading days
+# of history, number of Monte Carlo simulations (and the most allowed), and the size of
+# the random draws generated at once, which bounds the simulation memory
+DEFAULT_VAR_CONFIDENCE: float = 0.95
+DEFAULT_VAR_HORIZON_DAYS: int = 1
+DEFAULT_VAR_LOOKBACK_DAYS: int = 2 * 252
+DEFAULT_MC_SIMULATIONS: int = 10000
+MAX_MC_SIMULATIONS: int = 1000000
+MC_CHUNK_BYTES: int = 8 * 1024 * 1024
+
 # Default time period
 DEFAULT_PERIOD: int = 14 
 
+# Indicators supported by get_technical_indicators, with the names the agent may use
+# for them and the default parameters of the indicators that take more than a period
+SUPPORTED_INDICATORS: Tuple[str, ...] = ("sma", "ema", "rsi", "macd", "bbands")
+INDICATOR_ALIASES: Dict[str, str] = {"bollinger": "bbands", "bollinger_bands": "bbands", "bb": "bbands"}
+MACD_DEFAULT_PERIODS: Tuple[int, int, int] = (12, 26, 9)
+BBANDS_DEFAULT_NUM_STD: float = 2.0
+
+# Indicators that get_latest_indicator can keep current incrementally, where the
+# indicator state is persisted, and how many trading days of history are used to
+# build a new state (a multiple of the period so that EMA and RSI have converged)
+INCREMENTAL_INDICATORS: Tuple[str, ...] = ("sma", "ema", "rsi")
+DEFAULT_INDICATOR_STATE_DIR: str = "/tmp/indicator_state"
+INCREMENTAL_BOOTSTRAP_FACTOR: int = 10
+INCREMENTAL_MIN_BOOTSTRAP_BARS: int = 60
+
+# Backtest strategies with the names of their parameters and default values, the
+# most parameter combinations evaluated in one call and the default trading days
+# tested. Crossovers hold the ticker while the fast line is above the slow one; rsi
+# and bbands buy below the lower threshold/band and sell above the upper threshold
+# or the middle band
+BACKTEST_STRATEGIES: Dict[str, Tuple[Tuple[str, float], ...]] = {
+    "sma_cross": (("fast", 50), ("slow", 200)),
+    "ema_cross": (("fast", 12), ("slow", 26)),
+    "macd": (("fast", 12), ("slow", 26), ("signal", 9)),
+    "rsi": (("period", 14), ("lower", 30), ("upper", 70)),
+    "bbands": (("period", 20), ("num_std", BBANDS_DEFAULT_NUM_STD)),
+}
+MAX_BACKTEST_COMBINATIONS: int = 50
+DEFAULT_BACKTEST_DAYS: int = 3 * 252
+
+# Bedrock Agents allow 5 parameters per function by default, so the less common
+# settings of a function are sent in one `options` parameter as name=value pairs
+# (e.g. "interval=week,max_points=200"). These are the settings each function accepts
+# there; they may also be sent as parameters of their own when the quota allows it
+FUNCTION_OPTIONS: Dict[str, Tuple[str, ...]] = {
+    "get_stock_prices": ("interval", "output_format", "max_points"),
+    "get_technical_indicators": ("period", "interval", "output_format", "max_points"),
+    "get_batch_technical_indicators": ("period", "interval"),
+    "get_price_levels": ("window", "tolerance"),
+    "get_correlations": ("window", "risk_free_rate", "include_covariance"),
+    "get_portfolio_risk": ("start_date", "end_date", "simulations", "seed"),
+}
+
 # Set a logger
 logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Pooled HTTP session shared by all requests to the financial datasets API, so that
+# connections are reused across requests and concurrent fetches. The multi-ticker
+# functions load every ticker on a worker and fetch_price_ranges downloads the date
+# windows of a ticker on workers of its own, so api_get caps the requests in flight at
+# the pool size with a semaphore
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=PRICE_FETCH_MAX_WORKERS, pool_maxsize=PRICE_FETCH_MAX_WORKERS))
+api_request_slots = BoundedSemaphore(PRICE_FETCH_MAX_WORKERS)
+
+
+def api_get(url: str, **kwargs) -> requests.Response:
+    """
+    GET on the shared session, waiting for a free request slot first. Requests time out
+    after API_TIMEOUT_SECONDS unless the caller passes a timeout
+    """
+    kwargs.setdefault("timeout", API_TIMEOUT_SECONDS)
+    with api_request_slots:
+        return http_session.get(url, **kwargs)
+
 
 def get_named_parameter(event, name):
     """
@@ -26,7 +186,264 @@ def get_named_parameter(event, name):
     return next(item for item in event['parameters'] if item['name'] == name)['value']
 
 
-def get_stock_prices(ticker: str, start_date: str, end_date: str, limit: int = 5000) -> Union[Dict, str]:
+class PriceSeries:
+    """
+    Columnar representation of the price bars of one ticker. Bar times are kept as an
+    int64 array of epoch milliseconds sorted ascending and OHLCV as float64 arrays, so
+    the bars can be sliced by date with a binary search and fed to the indicator code
+    without building a dictionary per bar
+    """
+
+    COLUMNS: Tuple[str, ...] = ("open", "high", "low", "close", "volume")
+
+    def __init__(self, ticker: str, times: np.ndarray, open: np.ndarray, high: np.ndarray,
+                 low: np.ndarray, close: np.ndarray, volume: np.ndarray):
+        self.ticker = ticker
+        self.times = times
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @classmethod
+    def from_api_prices(cls, ticker: str, prices: List[Dict]) -> "PriceSeries":
+        """
+        Build a series from the bars returned by the prices API. The timestamps are
+        parsed in bulk by NumPy after dropping their timezone suffix
+        """
+        times = np.array([price['time'][:19] for price in prices], dtype='datetime64[s]')
+        # Missing (None) values become NaN in the float arrays
+        columns = [np.array([price.get(column) for price in prices], dtype=np.float64) for column in cls.COLUMNS]
+        series = cls(ticker, times.astype(np.int64) * 1000, *columns)
+        if len(series) > 1 and np.any(series.times[1:] < series.times[:-1]):
+            series = series.take(np.argsort(series.times, kind='stable'))
+        return series
+
+    @classmethod
+    def empty(cls, ticker: str) -> "PriceSeries":
+        return cls(ticker, np.empty(0, dtype=np.int64), *(np.empty(0) for _ in cls.COLUMNS))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def take(self, index) -> "PriceSeries":
+        """
+        Select bars by slice, mask or index array
+        """
+        return PriceSeries(self.ticker, self.times[index], *(getattr(self, column)[index] for column in self.COLUMNS))
+
+    @classmethod
+    def concat(cls, ticker: str, parts: List["PriceSeries"]) -> "PriceSeries":
+        """
+        Combine several series into one sorted by time. When more than one part holds a
+        bar with the same time, the bar from the later part wins, so that re-fetched or
+        overlapping bars are only kept once
+        """
+        if not parts:
+            return cls.empty(ticker)
+        times = np.concatenate([part.times for part in parts])
+        columns = [np.concatenate([getattr(part, column) for part in parts]) for column in cls.COLUMNS]
+        # np.unique keeps the first occurrence, so search the reversed arrays to keep the last one
+        _, reversed_index = np.unique(times[::-1], return_index=True)
+        index = len(times) - 1 - reversed_index
+        return cls(ticker, times[index], *(column[index] for column in columns))
+
+    def merge(self, other: "PriceSeries") -> "PriceSeries":
+        """
+        Combine with another series, preferring the bars of `other` on equal times
+        """
+        return PriceSeries.concat(self.ticker, [self, other])
+
+    def slice_dates(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> "PriceSeries":
+        """
+        Bars from the start of start_date through the end of end_date (YYYY-MM-DD),
+        located by binary search on the sorted times
+        """
+        lo = np.searchsorted(self.times, date_to_epoch_ms(start_date)) if start_date else 0
+        hi = np.searchsorted(self.times, date_to_epoch_ms(end_date) + MS_PER_DAY) if end_date else len(self)
+        return self.take(slice(lo, hi))
+
+    def time_strings(self) -> List[str]:
+        """
+        Bar times formatted as "%Y-%m-%d %H:%M:%S", converted in bulk
+        """
+        if len(self.times) == 0:
+            return []
+        formatted = np.datetime_as_string(self.times.astype('datetime64[ms]'), unit='s')
+        return np.char.replace(formatted, 'T', ' ').tolist()
+
+    def to_response(self) -> Dict:
+        """
+        Price bars as returned to the agent, one record per bar
+        """
+        columns = [self.time_strings(), self.times.tolist()] + [getattr(self, column).tolist() for column in self.COLUMNS]
+        keys = ("time", "time_milliseconds") + self.COLUMNS
+        return {"ticker": self.ticker, "prices": [dict(zip(keys, row)) for row in zip(*columns)]}
+
+    def to_columnar(self, delta_times: bool = False, decimals: int = COLUMNAR_DECIMALS) -> Dict:
+        """
+        Price bars as parallel arrays, see encode_columnar
+        """
+        columns = {column: getattr(self, column) for column in self.COLUMNS}
+        return {"ticker": self.ticker, **encode_columnar(self.times, columns, delta_times, decimals)}
+
+
+def encode_columnar(times: np.ndarray, columns: Dict[str, np.ndarray], delta_times: bool = False,
+                    decimals: int = COLUMNAR_DECIMALS) -> Dict:
+    """
+    Encode a time series as parallel arrays instead of one record per point. Times are
+    either formatted once per point (as dates only when every point is at midnight) or,
+    with delta_times, given as the first epoch millisecond time followed by the
+    differences between consecutive times. Values are rounded to a fixed number of
+    decimals and missing values become null
+    """
+    encoded = {"format": "columnar_delta" if delta_times else "columnar"}
+    if delta_times:
+        encoded["time_milliseconds_start"] = int(times[0]) if len(times) else None
+        encoded["time_milliseconds_delta"] = np.diff(times).tolist()
+    else:
+        formatted = np.datetime_as_string(times.astype('datetime64[ms]'), unit='s')
+        if len(times) and not np.any(times % MS_PER_DAY):
+            formatted = np.datetime_as_string(times.astype('datetime64[ms]'), unit='D')
+        encoded["time"] = np.char.replace(formatted, 'T', ' ').tolist() if len(times) else []
+    for key, values in columns.items():
+        encoded[key] = _round_or_none(values, decimals)
+    return encoded
+
+
+def _round_or_none(values: np.ndarray, decimals: int = 4) -> List[Optional[float]]:
+    return [None if value != value else value for value in np.round(values, decimals).tolist()]
+
+
+def _lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets. The first and last
+    points are always kept; the points in between are split into points - 2 buckets
+    and from every bucket the point forming the largest triangle with the previously
+    kept point and the average of the next bucket is kept
+    """
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1][:max(points, 1)] if n > 1 else [0])
+    starts = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    ends = starts[1:]
+    starts = starts[:-1]
+    counts = ends - starts
+    # Bucket averages from one reduceat over the inner points; the last bucket looks
+    # ahead to the final point instead of a bucket average
+    avg_x = np.add.reduceat(x[:-1], starts) / counts
+    avg_y = np.add.reduceat(y[:-1], starts) / counts
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for b in range(len(starts)):
+        xs = x[starts[b]:ends[b]]
+        ys = y[starts[b]:ends[b]]
+        area = np.abs((x[a] - next_x[b]) * (ys - y[a]) - (x[a] - xs) * (next_y[b] - y[a]))
+        a = starts[b] + int(np.argmax(area))
+        selected[b + 1] = a
+    return selected
+
+
+def _minmax_envelope(y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Indices of the lowest and highest point of each of points // 2 equal buckets, so
+    that every extreme of the series survives
+    """
+    n = len(y)
+    if points >= n:
+        return np.arange(n)
+    buckets = np.arange(n) * max(points // 2, 1) // n
+    order = np.lexsort((y, buckets))
+    bounds = np.flatnonzero(np.diff(buckets[order])) + 1
+    firsts = np.concatenate([[0], bounds])
+    lasts = np.concatenate([bounds - 1, [n - 1]])
+    return np.unique(np.concatenate([order[firsts], order[lasts]]))
+
+
+def downsample_indices(times: np.ndarray, values: np.ndarray, max_points: int, method: str = "lttb",
+                       recent_points: int = DOWNSAMPLE_RECENT_POINTS) -> np.ndarray:
+    """
+    Indices of at most max_points points that preserve the shape and extremes of a
+    series. The most recent points (up to half of the budget) are always kept at full
+    resolution and only the older part of the series is downsampled
+    """
+    n = len(times)
+    if n <= max_points:
+        return np.arange(n)
+    recent = min(recent_points, max_points // 2)
+    head = n - recent
+    values = np.nan_to_num(values.astype(np.float64), nan=np.nanmean(values) if np.any(~np.isnan(values)) else 0.0)
+    if method == "minmax":
+        kept = _minmax_envelope(values[:head], max_points - recent)
+    else:
+        kept = _lttb(times[:head].astype(np.float64), values[:head], max_points - recent)
+    return np.concatenate([kept, np.arange(head, n)])
+
+
+def choose_output_format(output_format: str, count: int, max_points: Optional[int],
+                         max_bytes: Optional[int], encode) -> str:
+    """
+    Format to send `count` points in. Rows that would have to be downsampled to fit
+    max_bytes are switched to the columnar format when every point fits that way, so
+    points are only dropped when neither format carries them all. `encode` builds the
+    response for every point in the given format
+    """
+    if output_format != "rows" or max_bytes is None or (max_points is not None and max_points < count):
+        return output_format
+    for candidate in ("rows", "columnar"):
+        if len(json.dumps(encode(candidate), separators=(',', ':'))) <= max_bytes:
+            return candidate
+    return output_format
+
+
+def fit_point_budget(count: int, max_points: Optional[int] = None, max_bytes: Optional[int] = None,
+                     encode=None) -> int:
+    """
+    Number of points that fit both budgets. The byte budget is converted into points
+    by serializing the response for no points and for a small sample of points with
+    `encode`, which builds the response for the first k points
+    """
+    budget = count if max_points is None else min(count, max(int(max_points), 1))
+    if max_bytes is not None and encode is not None and count:
+        sample = min(count, 32)
+        overhead = len(json.dumps(encode(0), separators=(',', ':')))
+        per_point = (len(json.dumps(encode(sample), separators=(',', ':'))) - overhead) / sample
+        budget = min(budget, max(int((max_bytes - overhead) / max(per_point, 1)), 1))
+    return budget
+
+
+def build_within_budget(count: int, max_points: Optional[int], max_bytes: Optional[int],
+                        encode, build) -> Dict:
+    """
+    Build the response for as many points as fit both budgets. The point budget is
+    first estimated with fit_point_budget (`encode` builds the response for the last k
+    points), then `build` builds the downsampled response for it, which is measured
+    and rebuilt with fewer points until it fits, so that max_bytes is a hard cap unless
+    a single point does not fit
+    """
+    budget = fit_point_budget(count, max_points, max_bytes, encode)
+    while True:
+        response = build(budget)
+        if max_bytes is None or budget <= 1:
+            return response
+        size = len(json.dumps(response, separators=(',', ':')))
+        if size <= max_bytes:
+            return response
+        budget = max(min(budget - 1, int(budget * max_bytes / size)), 1)
+
+
+def fetch_price_series(ticker: str, start_date: str, end_date: str, limit: int = 5000,
+                       base_interval: str = "day") -> Union[PriceSeries, Dict]:
+    """
+    Fetch daily or minute price bars from the API into a PriceSeries, or return an
+    error dict
+    """
     api_key = os.environ.get("FINANCIAL_DATASET_API")
     logger.info(f"API Key present: {'yes' if api_key else 'no'}")
     if not api_key:
@@ -37,23 +454,489 @@ def get_stock_prices(ticker: str, start_date: str, end_date: str, limit: int = 5
         f"?ticker={ticker}"
         f"&start_date={start_date}"
         f"&end_date={end_date}"
-        f"&interval=day"
+        f"&interval={base_interval}"
         f"&interval_multiplier=1"
         f"&limit={limit}"
     )
     try:
         logger.info(f"Making API request to: {url}")
-        response = requests.get(url, headers={'X-API-Key': api_key})
+        response = api_get(url, headers={'X-API-Key': api_key})
         logger.info(f"API response status code: {response.status_code}")
         if response.status_code != 200:
             logger.error(f"API error: {response.text}")
             return {"error": f"API returned status code {response.status_code}"}
-        return response.json()
+        return PriceSeries.from_api_prices(ticker, response.json().get("prices") or [])
     except Exception as e:
-        logger.error(f"Error in get_stock_prices: {str(e)}", exc_info=True)
+        logger.error(f"Error in fetch_price_series: {str(e)}", exc_info=True)
         return {"ticker": ticker, "prices": [], "error": str(e)}
 
 
+def date_to_epoch_ms(date: str) -> int:
+    """
+    Epoch milliseconds at the start of a YYYY-MM-DD date
+    """
+    return int(np.datetime64(date, 'ms').astype(np.int64))
+
+
+def _date_to_day(date: str) -> int:
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+
+def _day_to_date(day: int) -> str:
+    return str(np.datetime64(day, 'D'))
+
+
+def _split_date_range(start_day: int, end_day: int, chunk_days: int) -> List[Tuple[int, int]]:
+    """
+    Split an inclusive day range into consecutive windows of at most chunk_days days
+    """
+    return [(day, min(day + chunk_days - 1, end_day)) for day in range(start_day, end_day + 1, chunk_days)]
+
+
+def fetch_price_ranges(ticker: str, ranges: List[Tuple[str, str]], base_interval: str = "day",
+                       max_workers: int = PRICE_FETCH_MAX_WORKERS) -> Union[PriceSeries, Dict]:
+    """
+    Fetch the bars of one or more date ranges. Every range is split into windows of
+    PRICE_FETCH_CHUNK_DAYS days for the base interval that are downloaded concurrently
+    on the pooled session, and the
+    windows are merged in order with overlapping bars dropped. A window that comes
+    back with PRICE_FETCH_LIMIT rows was cut short by the API, so the rest of it is
+    fetched from its last bar onward until the window is complete
+    """
+    windows = []
+    for start_date, end_date in ranges:
+        windows += _split_date_range(_date_to_day(start_date), _date_to_day(end_date), PRICE_FETCH_CHUNK_DAYS[base_interval])
+    if not windows:
+        return PriceSeries.empty(ticker)
+
+    def fetch_window(window: Tuple[int, int]) -> Union[PriceSeries, Dict]:
+        start_day, end_day = window
+        parts = []
+        while True:
+            part = fetch_price_series(ticker, _day_to_date(start_day), _day_to_date(end_day), PRICE_FETCH_LIMIT, base_interval)
+            if isinstance(part, dict):
+                return part
+            parts.append(part)
+            if len(part) < PRICE_FETCH_LIMIT:
+                return PriceSeries.concat(ticker, parts)
+            last_day = int(part.times[-1] // MS_PER_DAY)
+            if last_day >= end_day or last_day <= start_day:
+                if last_day < end_day:
+                    logger.warning(f"More than {PRICE_FETCH_LIMIT} bars on {_day_to_date(last_day)} for {ticker}, keeping the first ones")
+                return PriceSeries.concat(ticker, parts)
+            # Continue from the day of the last bar; the overlap is dropped when merging
+            start_day = last_day
+
+    if len(windows) == 1:
+        parts = [fetch_window(windows[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as executor:
+            parts = list(executor.map(fetch_window, windows))
+    errors = [part for part in parts if isinstance(part, dict)]
+    if errors:
+        return errors[0]
+    return PriceSeries.concat(ticker, parts)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> np.datetime64:
+    """
+    The n-th given weekday (Monday is 0) of a month, or the last one when n is -1
+    """
+    if n < 0:
+        last = np.datetime64(f"{year + month // 12:04d}-{month % 12 + 1:02d}-01") - np.timedelta64(1, 'D')
+        return last - np.timedelta64((last.astype(object).weekday() - weekday) % 7, 'D')
+    first = np.datetime64(f"{year:04d}-{month:02d}-01")
+    return first + np.timedelta64((weekday - first.astype(object).weekday()) % 7 + 7 * (n - 1), 'D')
+
+
+def _observed(day: np.datetime64) -> np.datetime64:
+    """
+    Holidays on a Saturday are observed on the Friday before, on a Sunday the Monday after
+    """
+    weekday = day.astype(object).weekday()
+    return day - np.timedelta64(1, 'D') if weekday == 5 else day + np.timedelta64(1, 'D') if weekday == 6 else day
+
+
+def _easter(year: int) -> np.datetime64:
+    """
+    Gregorian Easter Sunday (anonymous Gregorian algorithm)
+    """
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return np.datetime64(f"{year:04d}-{month:02d}-{day:02d}")
+
+
+def nyse_holidays(first_year: int, last_year: int) -> np.ndarray:
+    """
+    Full-day NYSE closures between two years from the exchange holiday rules, plus the
+    unscheduled closures listed in NYSE_SPECIAL_CLOSURES
+    """
+    holidays = []
+    for year in range(first_year, last_year + 1):
+        new_year = np.datetime64(f"{year:04d}-01-01")
+        # A New Year's Day on a Saturday is not observed on the Friday before
+        if new_year.astype(object).weekday() != 5:
+            holidays.append(_observed(new_year))
+        if year >= 1998:
+            holidays.append(_nth_weekday(year, 1, 0, 3))
+        holidays.append(_nth_weekday(year, 2, 0, 3))
+        holidays.append(_easter(year) - np.timedelta64(2, 'D'))
+        holidays.append(_nth_weekday(year, 5, 0, -1))
+        if year >= 2022:
+            holidays.append(_observed(np.datetime64(f"{year:04d}-06-19")))
+        holidays.append(_observed(np.datetime64(f"{year:04d}-07-04")))
+        holidays.append(_nth_weekday(year, 9, 0, 1))
+        holidays.append(_nth_weekday(year, 11, 3, 4))
+        holidays.append(_observed(np.datetime64(f"{year:04d}-12-25")))
+    holidays += [np.datetime64(day) for day in NYSE_SPECIAL_CLOSURES]
+    return np.unique(np.array(holidays, dtype='datetime64[D]'))
+
+
+class TradingCalendar:
+    """
+    Offline NYSE trading calendar. All sessions between CALENDAR_FIRST_YEAR and
+    CALENDAR_LAST_YEAR are precomputed once into a sorted array of days, so session
+    lookups such as "N trading days before a date" are a binary search and an index
+    """
+
+    def __init__(self, first_year: int, last_year: int):
+        holidays = nyse_holidays(first_year, last_year)
+        self.busdaycalendar = np.busdaycalendar(weekmask="1111100", holidays=holidays)
+        days = np.arange(np.datetime64(f"{first_year:04d}-01-01"), np.datetime64(f"{last_year + 1:04d}-01-01"))
+        self.sessions = days[np.is_busday(days, busdaycal=self.busdaycalendar)].astype(np.int64)
+        self.first_day = int(days[0].astype(np.int64))
+        self.last_day = int(days[-1].astype(np.int64))
+
+    def _covers(self, *days: int) -> bool:
+        return all(self.first_day <= day <= self.last_day for day in days)
+
+    def sessions_between(self, start_day: int, end_day: int) -> int:
+        """
+        Number of sessions in an inclusive range of epoch days. Outside the precomputed
+        years only weekends are treated as closed
+        """
+        if self._covers(start_day, end_day):
+            return int(np.searchsorted(self.sessions, end_day, 'right') - np.searchsorted(self.sessions, start_day, 'left'))
+        return int(np.busday_count(np.datetime64(start_day, 'D'), np.datetime64(end_day + 1, 'D'), busdaycal=self.busdaycalendar))
+
+    def trading_days_before(self, date: str, sessions: int) -> str:
+        """
+        The date `sessions` trading sessions before `date`, so that the range from the
+        returned date up to the day before `date` holds exactly that many sessions
+        """
+        day = _date_to_day(date)
+        index = int(np.searchsorted(self.sessions, day, 'left')) - sessions
+        if self._covers(day) and index >= 0:
+            return _day_to_date(int(self.sessions[index]))
+        return str(np.busday_offset(np.datetime64(day, 'D'), -sessions, roll='forward', busdaycal=self.busdaycalendar))
+
+
+trading_calendar = TradingCalendar(CALENDAR_FIRST_YEAR, CALENDAR_LAST_YEAR)
+
+
+class PriceBarStore:
+    """
+    Per-ticker store of daily or minute price bars with an in-memory tier and a file tier. The
+    file tier keeps the bar times and an OHLCV matrix as .npy files that are memory
+    mapped on load, plus a JSON file with the date ranges already fetched. Reading a
+    date range only requests the days that are not covered yet from the API. Days up
+    to yesterday are marked as covered once fetched; today is re-fetched on every
+    read because its bar may still change.
+    """
+
+    def __init__(self, directory: str, base_interval: str = "day"):
+        self.directory = directory
+        self.base_interval = base_interval
+        self._series: Dict[str, PriceSeries] = {}
+        self._coverage: Dict[str, List[List[int]]] = {}
+
+    def _path(self, ticker: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{ticker}{suffix}")
+
+    def _load(self, ticker: str) -> None:
+        if ticker in self._series:
+            return
+        self._series[ticker] = PriceSeries.empty(ticker)
+        self._coverage[ticker] = []
+        if not os.path.exists(self._path(ticker, ".json")):
+            return
+        try:
+            with open(self._path(ticker, ".json")) as f:
+                coverage = json.load(f)["coverage"]
+            times = np.load(self._path(ticker, "_times.npy"), mmap_mode='r')
+            ohlcv = np.load(self._path(ticker, "_ohlcv.npy"), mmap_mode='r')
+            self._series[ticker] = PriceSeries(ticker, times, *ohlcv)
+            self._coverage[ticker] = coverage
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable price store files for {ticker}: {str(e)}")
+
+    def _persist(self, ticker: str) -> None:
+        series = self._series[ticker]
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            ohlcv = np.vstack([getattr(series, column) for column in PriceSeries.COLUMNS])
+            for suffix, array in (("_times.npy", series.times), ("_ohlcv.npy", ohlcv)):
+                with open(self._path(ticker, suffix + ".tmp"), "wb") as f:
+                    np.save(f, array)
+                os.replace(self._path(ticker, suffix + ".tmp"), self._path(ticker, suffix))
+            with open(self._path(ticker, ".json.tmp"), "w") as f:
+                json.dump({"coverage": self._coverage[ticker]}, f)
+            os.replace(self._path(ticker, ".json.tmp"), self._path(ticker, ".json"))
+        except OSError as e:
+            logger.warning(f"Could not persist price bars for {ticker}: {str(e)}")
+
+    def missing_ranges(self, ticker: str, start_day: int, end_day: int) -> List[Tuple[int, int]]:
+        """
+        Inclusive day ranges within [start_day, end_day] that are not covered yet
+        """
+        self._load(ticker)
+        gaps = []
+        cursor = start_day
+        for covered_start, covered_end in self._coverage[ticker]:
+            if covered_end < cursor:
+                continue
+            if covered_start > end_day:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start - 1))
+            cursor = max(cursor, covered_end + 1)
+        if cursor <= end_day:
+            gaps.append((cursor, end_day))
+        return gaps
+
+    def _mark_covered(self, ticker: str, start_day: int, end_day: int) -> None:
+        ranges = sorted(self._coverage[ticker] + [[start_day, end_day]])
+        merged = [ranges[0]]
+        for range_start, range_end in ranges[1:]:
+            if range_start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        self._coverage[ticker] = merged
+
+    def get_series(self, ticker: str, start_date: str, end_date: str) -> Union[PriceSeries, Dict]:
+        """
+        Get the bars of a ticker between two dates, fetching only the missing days
+        """
+        ticker = ticker.upper()
+        today = _date_to_day(datetime.utcnow().strftime("%Y-%m-%d"))
+        start_day = _date_to_day(start_date)
+        end_day = min(_date_to_day(end_date), today)
+        gaps = self.missing_ranges(ticker, start_day, end_day)
+        # Gaps made of weekends and exchange holidays only have no bars to fetch
+        fetch_gaps = [(a, b) for a, b in gaps if trading_calendar.sessions_between(a, b)]
+        if fetch_gaps:
+            logger.info(f"Fetching missing bars for {ticker}: {[(_day_to_date(a), _day_to_date(b)) for a, b in fetch_gaps]}")
+            fetched = fetch_price_ranges(ticker, [(_day_to_date(a), _day_to_date(b)) for a, b in fetch_gaps], self.base_interval)
+            if isinstance(fetched, dict):
+                return fetched
+            self._series[ticker] = self._series[ticker].merge(fetched)
+        if gaps:
+            for gap_start, gap_end in gaps:
+                if gap_start < today:
+                    self._mark_covered(ticker, gap_start, min(gap_end, today - 1))
+            self._persist(ticker)
+        return self._series[ticker].slice_dates(start_date, end_date)
+
+
+price_stores = {
+    base: PriceBarStore(os.path.join(os.environ.get("PRICE_STORE_DIR", DEFAULT_PRICE_STORE_DIR), base), base)
+    for base in ("day", "minute")
+}
+
+
+def parse_interval(interval: str) -> Tuple[str, int]:
+    """
+    Parse a bar interval such as "day", "week", "month", "5day", "15minute" or "hour"
+    into its unit and multiplier
+    """
+    text = interval.strip().lower().replace(" ", "").replace("_", "")
+    digits = len(text) - len(text.lstrip("0123456789"))
+    multiplier = int(text[:digits]) if digits else 1
+    name = text[digits:]
+    unit = INTERVAL_UNITS.get(name) or INTERVAL_UNITS.get(name[:-1] if name.endswith("s") else name)
+    if unit is None or multiplier < 1:
+        raise ValueError(f"Unsupported interval: {interval}")
+    return unit, multiplier
+
+
+def base_interval(unit: str) -> str:
+    """
+    The API interval whose bars are resampled into the given unit
+    """
+    return "minute" if unit in ("minute", "hour") else "day"
+
+
+def resample_price_series(series: PriceSeries, unit: str, multiplier: int = 1) -> PriceSeries:
+    """
+    Build coarser OHLCV bars from daily or minute base bars. Each base bar is assigned
+    to a bucket (calendar week starting Monday, calendar month, N calendar days since
+    the epoch, or N minutes), and every bucket becomes one bar stamped with the time of
+    its first base bar: first open, highest high, lowest low, last close, summed volume
+    """
+    if (unit, multiplier) in (("day", 1), ("minute", 1)) or len(series) == 0:
+        return series
+    days = series.times // MS_PER_DAY
+    if unit == "week":
+        # The epoch fell on a Thursday, so shifting by three days aligns weeks on Mondays
+        buckets = (days + 3) // (7 * multiplier)
+    elif unit == "month":
+        buckets = series.times.astype('datetime64[ms]').astype('datetime64[M]').astype(np.int64) // multiplier
+    elif unit == "day":
+        buckets = days // multiplier
+    else:
+        minutes = series.times // 60000
+        buckets = minutes // (multiplier * (60 if unit == "hour" else 1))
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+    ends = np.concatenate([starts[1:], [len(series)]]) - 1
+    return PriceSeries(
+        series.ticker,
+        series.times[starts],
+        series.open[starts],
+        np.maximum.reduceat(series.high, starts),
+        np.minimum.reduceat(series.low, starts),
+        series.close[ends],
+        np.add.reduceat(series.volume, starts)
+    )
+
+
+def load_price_series(ticker: str, start_date: str, end_date: str,
+                      interval: str = DEFAULT_INTERVAL) -> Union[PriceSeries, Dict]:
+    """
+    Get the bars of a ticker between two dates at the given interval, resampled from
+    the base bars held in the price bar store
+    """
+    try:
+        unit, multiplier = parse_interval(interval)
+    except ValueError as e:
+        return {"error": str(e)}
+    series = price_stores[base_interval(unit)].get_series(ticker, start_date, end_date)
+    if isinstance(series, dict):
+        return series
+    return resample_price_series(series, unit, multiplier)
+
+
+def _epoch_ms_to_date(time_ms: int) -> str:
+    return str(np.datetime64(int(time_ms), 'ms').astype('datetime64[D]'))
+
+
+def summarize_price_series(series: PriceSeries, periods_per_year: float,
+                           year_series: Optional[PriceSeries] = None) -> Dict:
+    """
+    Summary statistics of a price series computed with array operations: period
+    return, annualized volatility of log returns, maximum drawdown with its peak and
+    trough dates, average volume, opening gap statistics and, from year_series (the
+    last 52 weeks of daily bars), the 52-week range
+    """
+    if len(series) == 0:
+        return {"bars": 0}
+    close = series.close
+    log_returns = np.diff(np.log(close))
+    running_peak = np.maximum.accumulate(close)
+    drawdowns = close / running_peak - 1
+    trough = int(np.argmin(drawdowns))
+    peak = int(np.argmax(close[:trough + 1]))
+    gaps = series.open[1:] / close[:-1] - 1
+    summary = {
+        "bars": len(series),
+        "first_date": _epoch_ms_to_date(series.times[0]),
+        "last_date": _epoch_ms_to_date(series.times[-1]),
+        "first_close": round(float(close[0]), 4),
+        "last_close": round(float(close[-1]), 4),
+        "high": round(float(np.nanmax(series.high)), 4),
+        "low": round(float(np.nanmin(series.low)), 4),
+        "period_return": round(float(close[-1] / close[0] - 1), 4),
+        "annualized_volatility": round(float(np.std(log_returns, ddof=1) * np.sqrt(periods_per_year)), 4) if len(log_returns) > 1 else None,
+        "max_drawdown": round(float(drawdowns[trough]), 4),
+        "max_drawdown_peak_date": _epoch_ms_to_date(series.times[peak]),
+        "max_drawdown_trough_date": _epoch_ms_to_date(series.times[trough]),
+        "average_volume": round(float(np.nanmean(series.volume)), 2),
+    }
+    if len(gaps) and np.any(~np.isnan(gaps)):
+        largest_up = int(np.nanargmax(gaps))
+        largest_down = int(np.nanargmin(gaps))
+        summary["gaps"] = {
+            "threshold": GAP_THRESHOLD,
+            "gap_ups": int(np.sum(gaps > GAP_THRESHOLD)),
+            "gap_downs": int(np.sum(gaps < -GAP_THRESHOLD)),
+            "mean_absolute_gap": round(float(np.nanmean(np.abs(gaps))), 4),
+            "largest_gap_up": round(float(gaps[largest_up]), 4),
+            "largest_gap_up_date": _epoch_ms_to_date(series.times[largest_up + 1]),
+            "largest_gap_down": round(float(gaps[largest_down]), 4),
+            "largest_gap_down_date": _epoch_ms_to_date(series.times[largest_down + 1]),
+        }
+    if year_series is not None and len(year_series):
+        high_52w = float(np.nanmax(year_series.high))
+        low_52w = float(np.nanmin(year_series.low))
+        summary["52_week_high"] = round(high_52w, 4)
+        summary["52_week_low"] = round(low_52w, 4)
+        if high_52w > low_52w:
+            summary["52_week_range_position"] = round((float(year_series.close[-1]) - low_52w) / (high_52w - low_52w), 4)
+    return summary
+
+
+def get_stock_prices(ticker: str, start_date: str, end_date: str, limit: int = 5000,
+                     interval: str = DEFAULT_INTERVAL, output_format: str = DEFAULT_OUTPUT_FORMAT,
+                     max_points: Optional[int] = None, max_bytes: Optional[int] = None,
+                     downsample_method: str = "lttb") -> Union[Dict, str]:
+    """
+    Get the price bars of a ticker between two dates, at most `limit` bars, at the given
+    interval (e.g. "day", "week", "month", "5day", "15minute"), served from the price
+    bar store. The output format is one of OUTPUT_FORMATS, or "summary" for a few summary
+    statistics instead of the bars (see summarize_price_series). With a point or byte
+    budget, older bars are downsampled on the close price (see downsample_indices); the
+    lambda handler always passes the RESPONSE_MAX_BYTES budget
+    """
+    if output_format not in OUTPUT_FORMATS + ("summary",):
+        return {"error": f"Unsupported output format: {output_format}", "supported_formats": list(OUTPUT_FORMATS + ("summary",))}
+    if downsample_method not in DOWNSAMPLE_METHODS:
+        return {"error": f"Unsupported downsample method: {downsample_method}", "supported_methods": list(DOWNSAMPLE_METHODS)}
+    series = load_price_series(ticker, start_date, end_date, interval)
+    if isinstance(series, dict):
+        return series
+
+    # A summary describes the whole requested range, so `limit` only caps returned bars
+    if output_format == "summary":
+        unit, multiplier = parse_interval(interval)
+        year_start = trading_calendar.trading_days_before(end_date, TRADING_DAYS_PER_YEAR - 1)
+        year_series = price_stores["day"].get_series(ticker, year_start, end_date)
+        summary = summarize_price_series(
+            series,
+            TRADING_DAYS_PER_YEAR / (multiplier * SESSIONS_PER_BAR[unit]),
+            None if isinstance(year_series, dict) else year_series
+        )
+        return {"ticker": series.ticker, "interval": interval, "start_date": start_date, "end_date": end_date, **summary}
+
+    series = series.take(slice(0, limit))
+
+    def encode(bars: PriceSeries, fmt: str) -> Dict:
+        if fmt == "rows":
+            return bars.to_response()
+        return {"ticker": bars.ticker, "interval": interval, **bars.to_columnar(delta_times=fmt == "columnar_delta")}
+
+    output_format = choose_output_format(output_format, len(series), max_points, max_bytes,
+                                         lambda fmt: encode(series, fmt))
+
+    def build(budget: int) -> Dict:
+        kept = series.take(downsample_indices(series.times, series.close, budget, downsample_method))
+        response = encode(kept, output_format)
+        if len(kept) < len(series):
+            response["downsampled"] = {"method": downsample_method, "points": len(kept), "original_points": len(series)}
+        return response
+
+    if max_points is not None or max_bytes is not None:
+        return build_within_budget(len(series), max_points, max_bytes,
+                                   lambda k: encode(series.take(slice(len(series) - k, None)), output_format), build)
+    return encode(series, output_format)
+
+
 def get_current_stock_price(ticker: str) -> Union[Dict, str]:
     """
     Get current stock price based on the ticker provided by the user
@@ -65,107 +948,1159 @@ def get_current_stock_price(ticker: str) -> Union[Dict, str]:
     url = f"https://api.financialdatasets.ai/prices/snapshot?ticker={ticker}"
 
     try:
-        response = requests.get(url, headers={'X-API-Key': api_key})
+        response = api_get(url, headers={'X-API-Key': api_key})
         return response.json()
     except Exception as e:
         return {"ticker": ticker, "price": None, "error": str(e)}
 
 
+def _rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Maximum of every window of consecutive values (result[i] is the maximum of
+    values[i:i + window]), using block prefix and suffix maxima (van Herk / Gil-Werman)
+    so that the cost is O(n) regardless of the window length
+    """
+    n = len(values)
+    if window > n:
+        return np.empty(0)
+    blocks = -(-n // window)
+    padded = np.full(blocks * window, -np.inf)
+    padded[:n] = values
+    padded = padded.reshape(blocks, window)
+    prefix = np.maximum.accumulate(padded, axis=1).ravel()
+    suffix = np.maximum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    starts = np.arange(n - window + 1)
+    return np.maximum(suffix[starts], prefix[starts + window - 1])
+
+
+def find_swing_points(high: np.ndarray, low: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indices of swing highs and swing lows: bars whose high (low) is the extreme of the
+    window bars on either side. Of a run of equal extremes only the first bar counts
+    """
+    span = 2 * window + 1
+    if len(high) < span:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    centre = np.arange(window, len(high) - window)
+    highest = _rolling_max(high, span)
+    lowest = -_rolling_max(-low, span)
+    is_high = (high[centre] >= highest) & (high[centre] > high[centre - 1])
+    is_low = (low[centre] <= lowest) & (low[centre] < low[centre - 1])
+    return centre[is_high], centre[is_low]
+
+
+def cluster_price_levels(prices: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Cluster id of every price: after sorting, each cluster is anchored on its lowest
+    price and takes every price up to tolerance (relative) above the anchor, so a
+    level never spans more than the tolerance however densely the prices are spread.
+    The next cluster is anchored on the first price past that bound
+    """
+    order = np.argsort(prices)
+    sorted_prices = prices[order]
+    sorted_clusters = np.empty(len(prices), dtype=np.int64)
+    start, cluster = 0, 0
+    while start < len(sorted_prices):
+        end = int(np.searchsorted(sorted_prices, sorted_prices[start] * (1 + tolerance), side="right"))
+        # A level always takes its anchor, even when the tolerance does not widen it
+        end = max(end, start + 1)
+        sorted_clusters[start:end] = cluster
+        start, cluster = end, cluster + 1
+    clusters = np.empty(len(prices), dtype=np.int64)
+    clusters[order] = sorted_clusters
+    return clusters
+
+
+def get_price_levels(ticker: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                     interval: str = DEFAULT_INTERVAL, window: int = DEFAULT_SWING_WINDOW,
+                     tolerance: float = DEFAULT_LEVEL_TOLERANCE, max_levels: int = DEFAULT_MAX_LEVELS) -> Dict:
+    """
+    Support and resistance levels of a ticker. Swing highs and lows are found with
+    windowed comparisons over the price arrays, clustered into price levels and ranked
+    by how often the price touched them. Levels crossed by the close within the last
+    BREAKOUT_LOOKBACK_BARS bars are reported as breakouts. Only the compact levels
+    table is returned, not the bars. Without dates, the last year up to today is used
+    """
+    if window < 1:
+        return {"error": f"Window must be at least one bar, got {window}"}
+    if tolerance <= 0:
+        return {"error": f"Tolerance must be positive, got {tolerance}"}
+    end_date = end_date or datetime.utcnow().strftime("%Y-%m-%d")
+    start_date = start_date or trading_calendar.trading_days_before(end_date, TRADING_DAYS_PER_YEAR)
+    series = load_price_series(ticker, start_date, end_date, interval)
+    if isinstance(series, dict):
+        return series
+    result = {"ticker": series.ticker, "interval": interval, "start_date": start_date, "end_date": end_date,
+              "bars": len(series), "window": window, "tolerance": tolerance}
+    if len(series) < 2 * window + 1:
+        return {**result, "error": f"At least {2 * window + 1} bars are needed to find swing points"}
+
+    swing_highs, swing_lows = find_swing_points(series.high, series.low, window)
+    last_close = float(series.close[-1])
+    result.update({
+        "last_close": round(last_close, 4),
+        "swing_highs": len(swing_highs),
+        "swing_lows": len(swing_lows),
+    })
+    if len(swing_highs):
+        result["last_swing_high"] = {"time": _epoch_ms_to_date(series.times[swing_highs[-1]]),
+                                     "price": round(float(series.high[swing_highs[-1]]), 4)}
+    if len(swing_lows):
+        result["last_swing_low"] = {"time": _epoch_ms_to_date(series.times[swing_lows[-1]]),
+                                    "price": round(float(series.low[swing_lows[-1]]), 4)}
+    if not len(swing_highs) and not len(swing_lows):
+        return {**result, "levels": {}, "breakouts": []}
+
+    index = np.concatenate((swing_highs, swing_lows))
+    prices = np.concatenate((series.high[swing_highs], series.low[swing_lows]))
+    from_high = np.arange(len(index)) < len(swing_highs)
+    clusters = cluster_price_levels(prices, tolerance)
+    count = int(clusters.max()) + 1
+    touches = np.bincount(clusters, minlength=count)
+    level_prices = np.bincount(clusters, weights=prices, minlength=count) / touches
+    high_touches = np.bincount(clusters, weights=from_high, minlength=count).astype(np.int64)
+    first_touch = np.full(count, len(series))
+    np.minimum.at(first_touch, clusters, index)
+    last_touch = np.zeros(count, dtype=np.int64)
+    np.maximum.at(last_touch, clusters, index)
+
+    # Strongest levels first; ties go to the most recently touched level
+    top = np.lexsort((-last_touch, -touches))[:max_levels]
+    top = top[np.argsort(level_prices[top])]
+    levels = level_prices[top]
+
+    # Closes on either side of every level at once: a sign change between consecutive
+    # bars is a crossing, which counts as a breakout once the level had been touched
+    side = np.sign(series.close[None, :] - levels[:, None])
+    crossed = (side[:, 1:] != side[:, :-1]) & (side[:, 1:] != 0)
+    recent = max(len(series) - 1 - BREAKOUT_LOOKBACK_BARS, 0)
+    breakouts = []
+    for row, level in enumerate(top):
+        bars = np.flatnonzero(crossed[row, recent:]) + recent + 1
+        bars = bars[bars > first_touch[level]]
+        if len(bars):
+            bar = int(bars[-1])
+            breakouts.append({
+                "level": round(float(level_prices[level]), 4),
+                "direction": "up" if side[row, bar] > 0 else "down",
+                "time": _epoch_ms_to_date(series.times[bar]),
+                "close": round(float(series.close[bar]), 4)
+            })
+
+    result["levels"] = {
+        "price": _round_or_none(levels),
+        "type": ["support" if level < last_close else "resistance" for level in levels.tolist()],
+        "touches": touches[top].tolist(),
+        "swing_high_touches": high_touches[top].tolist(),
+        "first_touch": [_epoch_ms_to_date(series.times[i]) for i in first_touch[top]],
+        "last_touch": [_epoch_ms_to_date(series.times[i]) for i in last_touch[top]],
+    }
+    supports = levels[levels < last_close]
+    resistances = levels[levels >= last_close]
+    result["nearest_support"] = round(float(supports.max()), 4) if len(supports) else None
+    result["nearest_resistance"] = round(float(resistances.min()), 4) if len(resistances) else None
+    result["breakouts"] = breakouts
+    return result
+
+
+def _sma(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    Simple moving average along the last axis, computed from a cumulative sum
+    so that every bar costs O(1) regardless of the period. Bars without a full
+    window are NaN
+    """
+    out = np.full(values.shape, np.nan)
+    if period < 1 or values.shape[-1] < period:
+        return out
+    csum = np.cumsum(values, axis=-1)
+    out[..., period - 1] = csum[..., period - 1]
+    out[..., period:] = csum[..., period:] - csum[..., :-period]
+    out[..., period - 1:] /= period
+    return out
+
+
+def _ema(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    Exponential moving average along the last axis in a single recursive pass,
+    seeded with the first value of the series
+    """
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] == 0:
+        return out
+    multiplier = 2 / (period + 1)
+    ema = values[..., 0].copy()
+    for i in range(values.shape[-1]):
+        ema += (values[..., i] - ema) * multiplier
+        out[..., i] = ema
+    return out
+
+
+def _rsi(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    Relative strength index with Wilder smoothing along the last axis. The
+    average gain/loss is seeded with the simple mean of the first period
+    changes and then advanced recursively, so the first value lands on bar
+    `period` and earlier bars are NaN
+    """
+    out = np.full(values.shape, np.nan)
+    if period < 1 or values.shape[-1] <= period:
+        return out
+    changes = np.diff(values, axis=-1)
+    gains = np.clip(changes, 0, None)
+    losses = np.clip(-changes, 0, None)
+    avg_gain = gains[..., :period].mean(axis=-1)
+    avg_loss = losses[..., :period].mean(axis=-1)
+    avg_gains = np.empty(changes.shape[:-1] + (changes.shape[-1] - period + 1,))
+    avg_losses = np.empty_like(avg_gains)
+    avg_gains[..., 0] = avg_gain
+    avg_losses[..., 0] = avg_loss
+    for j, i in enumerate(range(period, changes.shape[-1]), start=1):
+        avg_gain = (avg_gain * (period - 1) + gains[..., i]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[..., i]) / period
+        avg_gains[..., j] = avg_gain
+        avg_losses[..., j] = avg_loss
+    out[..., period:] = _rsi_from_averages(avg_gains, avg_losses)
+    return out
+
+
+def _rsi_from_averages(avg_gain: np.ndarray, avg_loss: np.ndarray) -> np.ndarray:
+    """
+    Turn average gains and losses into RSI values, reporting 100 when there
+    were no losses in the window
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+    return np.where(avg_loss == 0, 100.0, rsi)
+
+
+def _rolling_std(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    Rolling population standard deviation along the last axis from cumulative
+    sums of the values and their squares. The series is centred first so the
+    cumulative sums stay small and the variance does not lose precision
+    """
+    out = np.full(values.shape, np.nan)
+    if period < 1 or values.shape[-1] < period:
+        return out
+    centred = values - values.mean(axis=-1, keepdims=True)
+    mean = _sma(centred, period)
+    mean_sq = _sma(centred * centred, period)
+    out[..., period - 1:] = np.sqrt(np.maximum(mean_sq[..., period - 1:] - mean[..., period - 1:] ** 2, 0))
+    return out
+
+
+class IndicatorContext:
+    """
+    Computes indicators over one close-price array and memoizes the shared
+    intermediates (SMA, EMA and rolling standard deviation per period), so that
+    several indicators requested together only build each intermediate once.
+    For example SMA-20 and Bollinger Bands 20 share the same rolling mean, and
+    EMA-12/26 are reused by MACD
+    """
+
+    def __init__(self, closes: np.ndarray):
+        self.closes = closes
+        self._cache: Dict[Tuple[str, int], np.ndarray] = {}
+
+    def _cached(self, key: Tuple[str, int], compute) -> np.ndarray:
+        if key not in self._cache:
+            self._cache[key] = compute(self.closes, key[1])
+        return self._cache[key]
+
+    def sma(self, period: int) -> np.ndarray:
+        return self._cached(("sma", period), _sma)
+
+    def ema(self, period: int) -> np.ndarray:
+        return self._cached(("ema", period), _ema)
+
+    def rsi(self, period: int) -> np.ndarray:
+        return self._cached(("rsi", period), _rsi)
+
+    def std(self, period: int) -> np.ndarray:
+        return self._cached(("std", period), _rolling_std)
+
+    def macd(self, fast: int, slow: int, signal: int) -> Dict[str, np.ndarray]:
+        macd_line = self.ema(fast) - self.ema(slow)
+        signal_line = _ema(macd_line, signal)
+        return {"macd": macd_line, "signal": signal_line, "histogram": macd_line - signal_line}
+
+    def bbands(self, period: int, num_std: float) -> Dict[str, np.ndarray]:
+        middle = self.sma(period)
+        width = self.std(period) * num_std
+        return {"middle": middle, "upper": middle + width, "lower": middle - width}
+
+    def compute(self, spec: Dict) -> Dict[str, np.ndarray]:
+        """
+        Compute the output columns for one parsed indicator spec
+        """
+        name = spec["indicator"]
+        if name == "macd":
+            return self.macd(spec["fast_period"], spec["slow_period"], spec["signal_period"])
+        if name == "bbands":
+            return self.bbands(spec["period"], spec["num_std"])
+        return {"value": getattr(self, name)(spec["period"])}
+
+
+def parse_indicator_specs(indicator: str, period: int = DEFAULT_PERIOD) -> List[Dict]:
+    """
+    Parse the indicator parameter into a list of indicator specs. Several indicators
+    can be requested at once as a comma separated list, each optionally followed by
+    its own parameters, for example "sma:50,sma:200,rsi,macd:12:26:9,bbands:20:2".
+    Indicators without an explicit period use the period of the call
+    """
+    specs = []
+    for token in indicator.split(","):
+        parts = [part.strip() for part in token.strip().lower().split(":")]
+        name = INDICATOR_ALIASES.get(parts[0], parts[0])
+        args = parts[1:]
+        if name not in SUPPORTED_INDICATORS:
+            raise ValueError(f"Unsupported indicator: {parts[0]}")
+        if name == "macd":
+            fast, slow, signal = [int(arg) for arg in args] + list(MACD_DEFAULT_PERIODS[len(args):])
+            specs.append({"indicator": name, "fast_period": fast, "slow_period": slow, "signal_period": signal})
+        elif name == "bbands":
+            specs.append({
+                "indicator": name,
+                "period": int(args[0]) if args else period,
+                "num_std": float(args[1]) if len(args) > 1 else BBANDS_DEFAULT_NUM_STD
+            })
+        else:
+            specs.append({"indicator": name, "period": int(args[0]) if args else period})
+    return specs
+
+
+def _spec_warmup(spec: Dict) -> int:
+    """
+    Number of bars an indicator needs before the first bar it reports: a full window
+    for SMA and Bollinger Bands, and INDICATOR_WARMUP_PERIODS periods for the recursive
+    EMA, RSI and MACD
+    """
+    if spec["indicator"] == "macd":
+        return INDICATOR_WARMUP_PERIODS * (spec["slow_period"] + spec["signal_period"])
+    if spec["indicator"] in ("sma", "bbands"):
+        return spec["period"] - 1
+    if spec["indicator"] == "rsi":
+        return spec["period"] * (INDICATOR_WARMUP_PERIODS + 1)
+    return spec["period"] * INDICATOR_WARMUP_PERIODS
+
+
+def _bars_before(date: str, bars: int, unit: str, multiplier: int) -> str:
+    """
+    First date to fetch so that the given number of bars of an interval precede `date`,
+    counted in trading sessions on the exchange calendar
+    """
+    sessions = int(np.ceil(bars * multiplier * SESSIONS_PER_BAR[unit]))
+    if unit in ("minute", "hour"):
+        # Intraday bars also need the session of `date` itself to line up on full days
+        sessions += 1
+    return trading_calendar.trading_days_before(date, sessions)
+
+
 def get_technical_indicators(ticker: str, indicator: str, period: int = 14,
-                           start_date: Optional[str] = None, end_date: Optional[str] = None) -> Union[Dict, str]:
+                           start_date: Optional[str] = None, end_date: Optional[str] = None,
+                           interval: str = DEFAULT_INTERVAL,
+                           output_format: str = DEFAULT_OUTPUT_FORMAT,
+                           max_points: Optional[int] = None, max_bytes: Optional[int] = None,
+                           downsample_method: str = "lttb") -> Union[Dict, str]:
     """
     This function calculates technical indicators based on the provided parameters.
-    It supports the following indicators: SMA, EMA, and RSI.
+    It supports the following indicators: SMA, EMA, RSI, MACD and Bollinger Bands.
+    Several indicators can be requested in one call (see parse_indicator_specs); the
+    prices are fetched once and all indicators are computed from the same close-price
+    array, sharing intermediates such as the EMA-12/26 or the rolling mean/std. The
+    indicators are computed on bars of the requested interval, resampled locally from
+    the cached daily or minute bars. The output format is one of OUTPUT_FORMATS. With a
+    point or byte budget (split between the indicators), older points are downsampled
+    on the primary output of each indicator (see downsample_indices); the lambda
+    handler always passes the RESPONSE_MAX_BYTES budget.
     """
     try:
-        adjusted_start = (datetime.strptime(start_date, "%Y-%m-%d") - timedelta(days=period * 2)).strftime("%Y-%m-%d")
+        if output_format not in OUTPUT_FORMATS:
+            return {"error": f"Unsupported output format: {output_format}", "supported_formats": list(OUTPUT_FORMATS)}
+        if downsample_method not in DOWNSAMPLE_METHODS:
+            return {"error": f"Unsupported downsample method: {downsample_method}", "supported_methods": list(DOWNSAMPLE_METHODS)}
+        try:
+            specs = parse_indicator_specs(indicator, period)
+            unit, multiplier = parse_interval(interval)
+        except ValueError as e:
+            return {"error": str(e), "supported_indicators": list(SUPPORTED_INDICATORS)}
+        warmup = max(_spec_warmup(spec) for spec in specs)
+        adjusted_start = _bars_before(start_date, warmup, unit, multiplier)
         
-        price_data = get_stock_prices(
+        series = load_price_series(
             ticker=ticker,
             start_date=adjusted_start,
             end_date=end_date,
-            limit=5000
+            interval=interval
         )
 
-        if "error" in price_data:
-            return price_data
-
-        # Convert price data to list of dictionaries with proper datetime
-        prices = price_data["prices"]
-        for price in prices:
-            price['time'] = price['time'].split(' EDT')[0].split(' EST')[0]
-            price['time'] = datetime.strptime(price['time'], "%Y-%m-%d %H:%M:%S")
-
-        # Filter date range
-        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-        end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-        prices = [p for p in prices if start_dt <= p['time'] <= end_dt]
-
-        result = {
-            "ticker": ticker,
-            "indicator": indicator,
-            "period": period,
-            "data": []
-        }
+        if isinstance(series, dict):
+            return series
 
-        if indicator.lower() == "sma":
-            for i in range(len(prices)):
-                if i >= period - 1:
-                    sum_prices = sum(p['close'] for p in prices[i-period+1:i+1])
-                    sma = sum_prices / period
-                    result["data"].append({
-                        "time": prices[i]['time'].strftime("%Y-%m-%d %H:%M:%S"),
-                        "time_milliseconds": int(prices[i]['time'].timestamp() * 1000),
-                        "value": float(sma)
-                    })
-        
-        elif indicator.lower() == "ema":
-            multiplier = 2 / (period + 1)
-            ema = prices[0]['close']
-            for i in range(len(prices)):
-                ema = (prices[i]['close'] - ema) * multiplier + ema
-                result["data"].append({
-                    "time": prices[i]['time'].strftime("%Y-%m-%d %H:%M:%S"),
-                    "time_milliseconds": int(prices[i]['time'].timestamp() * 1000),
-                    "value": float(ema)
-                })
-
-        elif indicator.lower() == "rsi":
-            changes = []
-            for i in range(1, len(prices)):
-                changes.append(prices[i]['close'] - prices[i-1]['close'])
-
-            for i in range(len(changes) - period + 1):
-                gains = sum(max(change, 0) for change in changes[i:i+period])
-                losses = sum(abs(min(change, 0)) for change in changes[i:i+period])
-                
-                avg_gain = gains / period
-                avg_loss = losses / period
-                
-                if avg_loss == 0:
-                    rsi = 100
-                else:
-                    rs = avg_gain / avg_loss
-                    rsi = 100 - (100 / (1 + rs))
-                
-                result["data"].append({
-                    "time": prices[i+period]['time'].strftime("%Y-%m-%d %H:%M:%S"),
-                    "time_milliseconds": int(prices[i+period]['time'].timestamp() * 1000),
-                    "value": float(rsi)
-                })
-        return result
+        # The indicators run over the warm-up bars too, which are trimmed from the output
+        context = IndicatorContext(series.close)
+        first = int(np.searchsorted(series.times, date_to_epoch_ms(start_date)))
+        time_strings = series.time_strings() if output_format == "rows" else None
+        times_ms = series.times.tolist()
+        results = []
+        spec_bytes = None
+        if max_bytes is not None:
+            # The byte budget is split evenly, less the envelope of a multi-indicator response
+            envelope = len(json.dumps({"ticker": ticker, "indicators": []}, separators=(',', ':'))) + len(specs) if len(specs) > 1 else 0
+            spec_bytes = max((max_bytes - envelope) // len(specs), 1)
+        for spec in specs:
+            outputs = context.compute(spec)
+
+            def encode(index: np.ndarray, fmt: str) -> Dict:
+                result = {"ticker": ticker, **spec, "interval": interval}
+                if fmt != "rows":
+                    columns = {key: values[index] for key, values in outputs.items()}
+                    result.update(encode_columnar(series.times[index], columns, delta_times=fmt == "columnar_delta"))
+                    return result
+                keys = ("time", "time_milliseconds") + tuple(outputs)
+                index = index.tolist()
+                columns = [[time_strings[i] for i in index], [times_ms[i] for i in index]]
+                columns += [values[index].tolist() for values in outputs.values()]
+                result["data"] = [dict(zip(keys, row)) for row in zip(*columns)]
+                return result
+
+            # The first output is the primary one; NaN marks a warm-up bar without a value yet
+            primary = next(iter(outputs.values()))
+            index = np.flatnonzero(~np.isnan(primary[first:])) + first
+            if max_points is None and max_bytes is None:
+                results.append(encode(index, output_format))
+                continue
+            spec_format = choose_output_format(output_format, len(index), max_points, spec_bytes,
+                                               lambda fmt: encode(index, fmt))
+
+            def build(budget: int) -> Dict:
+                kept = index[downsample_indices(series.times[index], primary[index], budget, downsample_method)]
+                result = encode(kept, spec_format)
+                if len(kept) < len(index):
+                    result["downsampled"] = {"method": downsample_method, "points": len(kept), "original_points": len(index)}
+                return result
+
+            results.append(build_within_budget(len(index), max_points, spec_bytes,
+                                               lambda k: encode(index[len(index) - k:], spec_format), build))
+
+        if len(results) == 1:
+            return results[0]
+        return {"ticker": ticker, "indicators": results}
     except Exception as e:
         logger.error(f"Error in get_technical_indicators: {str(e)}")
         raise e
 
 
+def _spec_label(spec: Dict) -> str:
+    """
+    Short column label of an indicator spec, e.g. "rsi_14" or "macd_12_26_9"
+    """
+    if spec["indicator"] == "macd":
+        return f"macd_{spec['fast_period']}_{spec['slow_period']}_{spec['signal_period']}"
+    if spec["indicator"] == "bbands":
+        return f"bbands_{spec['period']}_{spec['num_std']:g}"
+    return f"{spec['indicator']}_{spec['period']}"
+
+
+def parse_tickers(tickers: Union[str, List[str]]) -> List[str]:
+    """
+    Unique upper case tickers from a list or a comma separated string, in order
+    """
+    if isinstance(tickers, str):
+        tickers = [ticker.strip() for ticker in tickers.split(",")]
+    return list(dict.fromkeys(ticker.upper() for ticker in tickers if ticker))
+
+
+def get_batch_technical_indicators(tickers: Union[str, List[str]], indicator: str, period: int = DEFAULT_PERIOD,
+                                   start_date: Optional[str] = None, end_date: Optional[str] = None,
+                                   interval: str = DEFAULT_INTERVAL) -> Dict:
+    """
+    Compare the latest indicator values of several tickers in one call. The prices of
+    all tickers are loaded concurrently and the tickers that have the same bar times
+    (usually all of them) are stacked into a 2-D close-price array, one row per ticker,
+    so that the indicators are computed for all of them at once along the time axis.
+    A ticker with a shorter or gapped history forms its own group rather than cutting
+    the other rows, so every value is the one of the ticker's own latest bar, reported
+    in `time`. Only the latest value of every indicator is returned, as one column per
+    indicator with a value per ticker; a ticker without enough history for an
+    indicator is reported in `errors` instead. Without a start date, enough history to
+    warm up the indicators is used; the end date defaults to today.
+    """
+    tickers = parse_tickers(tickers)
+    try:
+        specs = parse_indicator_specs(indicator, period)
+        unit, multiplier = parse_interval(interval)
+    except ValueError as e:
+        return {"error": str(e), "supported_indicators": list(SUPPORTED_INDICATORS)}
+    if not tickers:
+        return {"error": "No tickers provided"}
+    end_date = end_date or datetime.utcnow().strftime("%Y-%m-%d")
+    warmup = max(_spec_warmup(spec) for spec in specs)
+    start_date = start_date or _bars_before(end_date, warmup + 1, unit, multiplier)
+
+    with ThreadPoolExecutor(max_workers=min(PRICE_FETCH_MAX_WORKERS, len(tickers))) as executor:
+        loaded = list(executor.map(lambda ticker: load_price_series(ticker, start_date, end_date, interval), tickers))
+    errors = {}
+    series_by_ticker = {}
+    for ticker, series in zip(tickers, loaded):
+        if isinstance(series, dict):
+            errors[ticker] = series.get("error", "Failed to load prices")
+        elif len(series) == 0:
+            errors[ticker] = "No price data in the requested range"
+        else:
+            series_by_ticker[ticker] = series
+    result = {"start_date": start_date, "end_date": end_date, "interval": interval}
+    if not series_by_ticker:
+        return {**result, "error": "No price data for any ticker", "errors": errors}
+
+    groups: Dict[bytes, List[str]] = {}
+    for ticker, series in series_by_ticker.items():
+        groups.setdefault(series.times.tobytes(), []).append(ticker)
+    latest: Dict[str, Dict[str, float]] = {ticker: {} for ticker in series_by_ticker}
+    for group in groups.values():
+        context = IndicatorContext(np.vstack([series_by_ticker[ticker].close for ticker in group]))
+        for spec in specs:
+            for key, column in context.compute(spec).items():
+                label = _spec_label(spec) if key in ("value", "macd", "middle") else f"{_spec_label(spec)}_{key}"
+                for ticker, value in zip(group, column[:, -1]):
+                    latest[ticker][label] = value
+    for ticker, ticker_values in latest.items():
+        missing = [label for label, value in ticker_values.items() if np.isnan(value)]
+        if missing:
+            errors[ticker] = f"Insufficient history ({len(series_by_ticker[ticker])} bars) for {', '.join(missing)}"
+            del series_by_ticker[ticker]
+    if not series_by_ticker:
+        return {**result, "error": "Not enough price data for any ticker", "errors": errors}
+
+    labels = list(next(iter(latest.values())))
+    result.update({
+        "tickers": list(series_by_ticker),
+        "bars": [len(series) for series in series_by_ticker.values()],
+        "time": [series.time_strings()[-1] for series in series_by_ticker.values()],
+        "close": _round_or_none(np.array([series.close[-1] for series in series_by_ticker.values()])),
+        "values": {label: _round_or_none(np.array([latest[ticker][label] for ticker in series_by_ticker]))
+                   for label in labels}
+    })
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+def load_aligned_closes(tickers: List[str], start_date: str, end_date: str
+                        ) -> Tuple[List[str], np.ndarray, np.ndarray, Dict[str, str]]:
+    """
+    Daily closes of several tickers aligned on the trading dates they all have. The
+    series are loaded concurrently from the daily bar store and their sorted bar times
+    are merged by intersection. Returns the tickers that have data, the common bar
+    times, a 2-D close array (one row per ticker) and the errors of the other tickers
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(PRICE_FETCH_MAX_WORKERS, len(tickers)))) as executor:
+        loaded = list(executor.map(lambda ticker: price_stores["day"].get_series(ticker, start_date, end_date), tickers))
+    errors = {}
+    series_by_ticker = {}
+    for ticker, series in zip(tickers, loaded):
+        if isinstance(series, dict):
+            errors[ticker] = series.get("error", "Failed to load prices")
+        elif len(series) == 0:
+            errors[ticker] = "No price data in the requested range"
+        else:
+            series_by_ticker[ticker] = series
+    if not series_by_ticker:
+        return [], np.empty(0, dtype=np.int64), np.empty((0, 0)), errors
+    times = reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True),
+                   [series.times for series in series_by_ticker.values()])
+    closes = np.vstack([series.close[np.searchsorted(series.times, times)] for series in series_by_ticker.values()])
+    return list(series_by_ticker), times, closes, errors
+
+
+def _round_matrix(matrix: np.ndarray, decimals: int = 4) -> List[List[Optional[float]]]:
+    return [_round_or_none(row, decimals) for row in matrix]
+
+
+def get_correlations(tickers: Union[str, List[str]], benchmark: str = DEFAULT_BENCHMARK,
+                     start_date: Optional[str] = None, end_date: Optional[str] = None,
+                     window: int = DEFAULT_RISK_WINDOW, risk_free_rate: float = DEFAULT_RISK_FREE_RATE,
+                     include_covariance: bool = False) -> Dict:
+    """
+    Relate several tickers to each other and to a benchmark. Daily closes are aligned
+    on common trading dates and turned into one return matrix (one row per ticker), from
+    which the correlation and annualized covariance matrices, the beta against the
+    benchmark and rolling beta, volatility and Sharpe ratio over the window are all
+    computed at once; the rolling statistics use cumulative-sum windows. Rolling
+    statistics are summarized by their latest, minimum and maximum values. Without
+    dates, the last year up to today is used
+    """
+    tickers = parse_tickers(tickers)
+    benchmark = benchmark.upper() if benchmark else None
+    if not tickers:
+        return {"error": "No tickers provided"}
+    end_date = end_date or datetime.utcnow().strftime("%Y-%m-%d")
+    start_date = start_date or trading_calendar.trading_days_before(end_date, TRADING_DAYS_PER_YEAR)
+    requested = tickers + [benchmark] if benchmark and benchmark not in tickers else tickers
+    names, times, closes, errors = load_aligned_closes(requested, start_date, end_date)
+    result = {"start_date": start_date, "end_date": end_date, "benchmark": benchmark}
+    if len(times) < 3:
+        return {**result, "error": "Not enough common trading dates across the tickers", "errors": errors}
+
+    returns = closes[:, 1:] / closes[:, :-1] - 1
+    covariance = np.cov(returns)
+    variance = np.diag(covariance)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = covariance / np.sqrt(np.outer(variance, variance))
+    result.update({
+        "tickers": names,
+        "returns": returns.shape[1],
+        "annualized_return": _round_or_none(np.prod(1 + returns, axis=1) ** (TRADING_DAYS_PER_YEAR / returns.shape[1]) - 1),
+        "annualized_volatility": _round_or_none(np.sqrt(variance * TRADING_DAYS_PER_YEAR)),
+        "correlation": _round_matrix(correlation, 3)
+    })
+    if include_covariance:
+        result["covariance"] = _round_matrix(covariance * TRADING_DAYS_PER_YEAR, 6)
+
+    b = names.index(benchmark) if benchmark in names else None
+    if b is not None:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result["beta"] = _round_or_none(covariance[:, b] / covariance[b, b])
+    elif benchmark:
+        errors.setdefault(benchmark, "No benchmark price data")
+
+    if returns.shape[1] >= window:
+        # Rolling means of the centred returns and their cross products give the
+        # rolling (co)variances from O(n) cumulative sums
+        centred = returns - returns.mean(axis=1, keepdims=True)
+        mean = _sma(centred, window)
+        rolling_std = np.sqrt(np.maximum(_sma(centred * centred, window) - mean ** 2, 0))[:, window - 1:]
+        excess = _sma(returns, window)[:, window - 1:] - risk_free_rate / TRADING_DAYS_PER_YEAR
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rolling = {
+                "volatility": rolling_std * np.sqrt(TRADING_DAYS_PER_YEAR),
+                "sharpe": excess / rolling_std * np.sqrt(TRADING_DAYS_PER_YEAR)
+            }
+            if b is not None:
+                cross = _sma(centred * centred[b], window) - mean * mean[b]
+                rolling["beta"] = (cross / cross[b])[:, window - 1:]
+        result["rolling"] = {"window": window}
+        for name, values in rolling.items():
+            values = np.where(np.isfinite(values), values, np.nan)
+            valid = ~np.all(np.isnan(values), axis=1)
+            low = np.full(len(values), np.nan)
+            high = np.full(len(values), np.nan)
+            low[valid] = np.nanmin(values[valid], axis=1)
+            high[valid] = np.nanmax(values[valid], axis=1)
+            result["rolling"][name] = {
+                "latest": _round_or_none(values[:, -1]),
+                "min": _round_or_none(low),
+                "max": _round_or_none(high)
+            }
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+def parse_holdings(holdings: Union[str, Dict[str, float]]) -> Dict[str, float]:
+    """
+    Portfolio weights by ticker from a dict or a string like "AAPL:0.5,MSFT:0.3,NVDA:0.2",
+    normalized to sum to one. Weights may also be position sizes, e.g. dollar amounts,
+    and a ticker without a weight counts as one unit. Raises ValueError on bad input
+    """
+    if isinstance(holdings, str):
+        parsed = {}
+        for item in holdings.split(","):
+            if not item.strip():
+                continue
+            ticker, _, weight = item.partition(":")
+            try:
+                parsed[ticker.strip().upper()] = parsed.get(ticker.strip().upper(), 0.0) + float(weight or 1)
+            except ValueError:
+                raise ValueError(f"Invalid weight in holding: {item.strip()}")
+        holdings = parsed
+    total = sum(holdings.values())
+    if not holdings or total == 0:
+        raise ValueError("Holdings must contain tickers whose weights do not sum to zero")
+    return {ticker.upper(): weight / total for ticker, weight in holdings.items()}
+
+
+def _cholesky(covariance: np.ndarray) -> np.ndarray:
+    """
+    Lower triangular factor L with L @ L.T equal to the covariance. A covariance that is
+    not positive definite (e.g. perfectly correlated tickers or fewer days than tickers)
+    falls back to its eigen decomposition with negative eigenvalues clipped to zero
+    """
+    try:
+        return np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        return eigenvectors * np.sqrt(np.maximum(eigenvalues, 0))
+
+
+def _var_cvar(returns: np.ndarray, confidence: float) -> Dict[str, float]:
+    """
+    Value at risk and conditional value at risk (expected shortfall) of a sample of
+    returns, both as positive fractions of the portfolio value
+    """
+    cutoff = np.quantile(returns, 1 - confidence)
+    return {"var": round(float(-cutoff), 6), "cvar": round(float(-returns[returns <= cutoff].mean()), 6)}
+
+
+def simulate_portfolio_returns(drift: np.ndarray, covariance: np.ndarray, weights: np.ndarray,
+                               horizon: int, simulations: int, rng: np.random.Generator,
+                               chunk_bytes: int = MC_CHUNK_BYTES) -> np.ndarray:
+    """
+    Monte Carlo portfolio returns over the horizon with correlated geometric Brownian
+    motion: the log returns of the tickers are drawn as multivariate normal through the
+    Cholesky factor of their daily covariance, scaled to the horizon (the horizon log
+    return of a GBM is normal, so no intermediate steps are needed). Simulations are
+    generated in chunks of at most chunk_bytes of random draws, so memory stays fixed
+    apart from the one return per simulation that is kept
+    """
+    factor = _cholesky(covariance * horizon)
+    chunk = max(1, chunk_bytes // (8 * len(weights)))
+    results = np.empty(simulations)
+    for begin in range(0, simulations, chunk):
+        size = min(chunk, simulations - begin)
+        log_returns = drift * horizon + rng.standard_normal((size, len(weights))) @ factor.T
+        results[begin:begin + size] = np.expm1(log_returns) @ weights
+    return results
+
+
+def get_portfolio_risk(holdings: Union[str, Dict[str, float]], confidence: float = DEFAULT_VAR_CONFIDENCE,
+                       horizon_days: int = DEFAULT_VAR_HORIZON_DAYS, start_date: Optional[str] = None,
+                       end_date: Optional[str] = None, simulations: int = DEFAULT_MC_SIMULATIONS,
+                       seed: Optional[int] = None, portfolio_value: Optional[float] = None) -> Dict:
+    """
+    Value at risk and conditional value at risk of a portfolio of tickers held at the
+    given weights, over a horizon of trading days, with three methods on the same
+    aligned daily closes: historical (overlapping horizon returns of the portfolio),
+    parametric (normal portfolio returns) and Monte Carlo (correlated GBM, see
+    simulate_portfolio_returns). Pass a seed to reproduce the Monte Carlo results.
+    Losses are positive fractions of the portfolio value, and amounts as well when the
+    portfolio value is given. Without dates, the last two years up to today are used
+    """
+    try:
+        weights_by_ticker = parse_holdings(holdings)
+    except ValueError as e:
+        return {"error": str(e)}
+    if not 0 < confidence < 1:
+        return {"error": f"Confidence must be between 0 and 1, got {confidence}"}
+    if horizon_days < 1:
+        return {"error": f"Horizon must be at least one trading day, got {horizon_days}"}
+    simulations = min(max(int(simulations), 1), MAX_MC_SIMULATIONS)
+    end_date = end_date or datetime.utcnow().strftime("%Y-%m-%d")
+    start_date = start_date or trading_calendar.trading_days_before(end_date, DEFAULT_VAR_LOOKBACK_DAYS)
+    names, times, closes, errors = load_aligned_closes(list(weights_by_ticker), start_date, end_date)
+    result = {"start_date": start_date, "end_date": end_date, "confidence": confidence, "horizon_days": horizon_days}
+    if errors:
+        return {**result, "error": "Prices are missing for some holdings", "errors": errors}
+    if len(times) < horizon_days + 2:
+        return {**result, "error": "Not enough common trading dates across the holdings"}
+
+    weights = np.array([weights_by_ticker[name] for name in names])
+    log_returns = np.diff(np.log(closes), axis=1)
+    portfolio = np.expm1(log_returns).T @ weights
+
+    # Overlapping horizon returns of the daily rebalanced portfolio
+    cumulative = np.concatenate(([0.0], np.cumsum(np.log1p(portfolio))))
+    historical = np.expm1(cumulative[horizon_days:] - cumulative[:-horizon_days])
+
+    normal = NormalDist(float(portfolio.mean()) * horizon_days, float(portfolio.std(ddof=1)) * np.sqrt(horizon_days))
+    z = NormalDist().inv_cdf(1 - confidence)
+    parametric = {
+        "var": round(-normal.inv_cdf(1 - confidence), 6),
+        "cvar": round(-(normal.mean - normal.stdev * NormalDist().pdf(z) / (1 - confidence)), 6)
+    }
+
+    rng = np.random.default_rng(seed)
+    simulated = simulate_portfolio_returns(log_returns.mean(axis=1), np.atleast_2d(np.cov(log_returns)),
+                                           weights, horizon_days, simulations, rng)
+    result.update({
+        "holdings": {name: round(float(weight), 6) for name, weight in zip(names, weights)},
+        "observations": log_returns.shape[1],
+        "historical": {**_var_cvar(historical, confidence), "scenarios": len(historical)},
+        "parametric": parametric,
+        "monte_carlo": {**_var_cvar(simulated, confidence), "simulations": simulations, "seed": seed}
+    })
+    if portfolio_value:
+        result["portfolio_value"] = portfolio_value
+        for method in ("historical", "parametric", "monte_carlo"):
+            result[method]["var_amount"] = round(result[method]["var"] * portfolio_value, 2)
+            result[method]["cvar_amount"] = round(result[method]["cvar"] * portfolio_value, 2)
+    return result
+
+
+def parse_strategy(strategy: str) -> Tuple[str, List[Dict[str, float]]]:
+    """
+    Parse a backtest strategy into its name and the grid of parameter combinations.
+    Parameters follow the name separated by colons in the order of BACKTEST_STRATEGIES,
+    and each may list several values separated by commas, e.g. "sma_cross:20,50:100,200"
+    evaluates the four fast/slow combinations. Omitted parameters use their defaults
+    """
+    parts = [part.strip() for part in strategy.strip().lower().split(":")]
+    name = parts[0]
+    if name not in BACKTEST_STRATEGIES:
+        raise ValueError(f"Unsupported strategy: {name}")
+    defaults = BACKTEST_STRATEGIES[name]
+    if len(parts) - 1 > len(defaults):
+        raise ValueError(f"Too many parameters for {name}, expected {', '.join(key for key, _ in defaults)}")
+    values = []
+    for i, (key, default) in enumerate(defaults):
+        given = parts[i + 1] if i + 1 < len(parts) and parts[i + 1] else None
+        cast = float if isinstance(default, float) else int
+        values.append([cast(value) for value in given.split(",")] if given else [default])
+    grid = [dict(zip([key for key, _ in defaults], combination)) for combination in product(*values)]
+    if len(grid) > MAX_BACKTEST_COMBINATIONS:
+        raise ValueError(f"Too many parameter combinations: {len(grid)} (at most {MAX_BACKTEST_COMBINATIONS})")
+    return name, grid
+
+
+def _strategy_specs(name: str, params: Dict[str, float]) -> List[Dict]:
+    """
+    Indicator specs a strategy is computed from, used for their warm-up
+    """
+    if name in ("sma_cross", "ema_cross"):
+        return [{"indicator": name[:3], "period": params["slow"]}]
+    if name == "macd":
+        return [{"indicator": "macd", "fast_period": params["fast"], "slow_period": params["slow"],
+                 "signal_period": params["signal"]}]
+    return [{"indicator": name, "period": params["period"]}]
+
+
+def _hold_between(entries: np.ndarray, exits: np.ndarray) -> np.ndarray:
+    """
+    Positions of a rule that enters on `entries` and exits on `exits` (entries win
+    when both occur), held in between: the latest event of every bar is found with a
+    running maximum of event indices along the last axis
+    """
+    events = np.where(entries, 1, np.where(exits, 0, -1))
+    latest = np.where(events >= 0, np.arange(events.shape[-1]), 0)
+    latest = np.maximum.accumulate(latest, axis=-1)
+    return np.take_along_axis(events, latest, axis=-1) == 1
+
+
+def strategy_signals(context: IndicatorContext, name: str, params: Dict[str, float]) -> np.ndarray:
+    """
+    Boolean array (same shape as the closes of the context) that is True where the
+    strategy wants to hold the ticker after the close of the bar. Indicator arrays come
+    from the context, so a parameter grid computes every distinct indicator only once
+    """
+    if name == "sma_cross":
+        return context.sma(params["fast"]) > context.sma(params["slow"])
+    if name == "ema_cross":
+        return context.ema(params["fast"]) > context.ema(params["slow"])
+    if name == "macd":
+        macd = context.macd(params["fast"], params["slow"], params["signal"])
+        return macd["macd"] > macd["signal"]
+    if name == "rsi":
+        rsi = context.rsi(params["period"])
+        return _hold_between(rsi < params["lower"], rsi > params["upper"])
+    bands = context.bbands(params["period"], params["num_std"])
+    return _hold_between(context.closes < bands["lower"], context.closes > bands["middle"])
+
+
+def backtest_metrics(positions: np.ndarray, returns: np.ndarray, periods_per_year: float) -> Dict[str, np.ndarray]:
+    """
+    Performance of positions (rows of 0/1 held over each bar return) against the bar
+    returns: total and annualized return, annualized volatility, Sharpe ratio, maximum
+    drawdown, exposure, number of trades and hit rate (share of trades with a gain).
+    Trades are the runs of held bars, found from the position changes of all rows at once
+    """
+    strategy = positions * returns
+    cumulative = np.concatenate((np.zeros((len(strategy), 1)), np.cumsum(np.log1p(strategy), axis=1)), axis=1)
+    equity = np.exp(cumulative)
+    drawdown = equity / np.maximum.accumulate(equity, axis=1) - 1
+    volatility = strategy.std(axis=1)
+
+    changes = np.diff(np.pad(positions.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    trade_rows, trade_starts = np.nonzero(changes == 1)
+    _, trade_ends = np.nonzero(changes == -1)
+    gains = cumulative[trade_rows, trade_ends] > cumulative[trade_rows, trade_starts]
+    trades = np.bincount(trade_rows, minlength=len(strategy))
+    wins = np.bincount(trade_rows, weights=gains, minlength=len(strategy))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "total_return": np.expm1(cumulative[:, -1]),
+            "annualized_return": np.expm1(cumulative[:, -1] * periods_per_year / strategy.shape[1]),
+            "volatility": volatility * np.sqrt(periods_per_year),
+            "sharpe": np.where(volatility > 0, strategy.mean(axis=1) / volatility * np.sqrt(periods_per_year), np.nan),
+            "max_drawdown": drawdown.min(axis=1),
+            "exposure": positions.mean(axis=1),
+            "trades": trades,
+            "hit_rate": np.where(trades > 0, wins / trades, np.nan)
+        }
+
+
+def backtest_strategy(tickers: Union[str, List[str]], strategy: str, start_date: Optional[str] = None,
+                      end_date: Optional[str] = None) -> Dict:
+    """
+    Backtest a rule-based strategy on the daily closes of several tickers over a grid
+    of parameters (see parse_strategy). The closes are aligned on common trading dates
+    with enough history before the start date to warm up the indicators; the signals of
+    every parameter combination and ticker are evaluated as one boolean array, and a
+    position is taken at the close after a signal, so there is no look-ahead. Returns
+    the metrics of backtest_metrics per combination (one value per ticker), buy and hold
+    for comparison and the best combination per ticker by Sharpe ratio. Without dates,
+    the last three years up to today are tested
+    """
+    tickers = parse_tickers(tickers)
+    try:
+        name, grid = parse_strategy(strategy)
+    except ValueError as e:
+        return {"error": str(e), "supported_strategies": list(BACKTEST_STRATEGIES)}
+    if not tickers:
+        return {"error": "No tickers provided"}
+    end_date = end_date or datetime.utcnow().strftime("%Y-%m-%d")
+    start_date = start_date or trading_calendar.trading_days_before(end_date, DEFAULT_BACKTEST_DAYS)
+    warmup = max(_spec_warmup(spec) for params in grid for spec in _strategy_specs(name, params))
+    names, times, closes, errors = load_aligned_closes(
+        tickers, trading_calendar.trading_days_before(start_date, warmup + 1), end_date)
+    result = {"strategy": name, "start_date": start_date, "end_date": end_date}
+    first = int(np.searchsorted(times, date_to_epoch_ms(start_date)))
+    if len(times) - first < 2:
+        return {**result, "error": "Not enough common trading dates across the tickers", "errors": errors}
+
+    context = IndicatorContext(closes)
+    signals = np.stack([strategy_signals(context, name, params) for params in grid])
+    returns = closes[:, first + 1:] / closes[:, first:-1] - 1
+    # The position over each bar return is the signal at the close before it
+    positions = signals[:, :, first:-1].reshape(-1, returns.shape[1])
+    metrics = backtest_metrics(positions, np.tile(returns, (len(grid), 1)), TRADING_DAYS_PER_YEAR)
+    metrics = {key: values.reshape(len(grid), len(names)) for key, values in metrics.items()}
+
+    def encode(values: np.ndarray) -> List:
+        return values.tolist() if values.dtype.kind == "i" else _round_or_none(values)
+
+    benchmark = backtest_metrics(np.ones_like(returns), returns, TRADING_DAYS_PER_YEAR)
+    best = np.argmax(np.where(np.isnan(metrics["sharpe"]), -np.inf, metrics["sharpe"]), axis=0)
+    result.update({
+        "tickers": names,
+        "bars": returns.shape[1],
+        "results": [
+            {"parameters": params, **{key: encode(values[i]) for key, values in metrics.items()}}
+            for i, params in enumerate(grid)
+        ],
+        "buy_and_hold": {key: encode(benchmark[key]) for key in ("total_return", "annualized_return", "volatility", "sharpe", "max_drawdown")},
+        "best_by_sharpe": [grid[i] for i in best.tolist()]
+    })
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+class IndicatorState:
+    """
+    Running state of one indicator for one ticker, so that the latest value can be
+    kept current by advancing over newly arrived bars in O(new bars) instead of
+    recomputing from the whole history. It holds the last `period` closes and their
+    running sum for SMA, the last EMA value, and the Wilder average gain/loss for
+    RSI, and advances with the same recurrences as _sma, _ema and _rsi.
+    """
+
+    def __init__(self, ticker: str, indicator: str, period: int):
+        self.ticker = ticker
+        self.indicator = indicator
+        self.period = period
+        self.last_time_ms: Optional[int] = None
+        self.last_close: Optional[float] = None
+        self.bars: int = 0
+        self.window: deque = deque(maxlen=period)
+        self.window_sum: float = 0.0
+        self.ema: Optional[float] = None
+        self.avg_gain: float = 0.0
+        self.avg_loss: float = 0.0
+
+    @property
+    def key(self) -> str:
+        return indicator_state_key(self.ticker, self.indicator, self.period)
+
+    def advance(self, times_ms: List[int], closes: List[float]) -> int:
+        """
+        Advance the state over bars sorted by time, skipping any bar that is not newer
+        than the last bar already applied. Returns the number of bars applied
+        """
+        applied = 0
+        period = self.period
+        for time_ms, close in zip(times_ms, closes):
+            if self.last_time_ms is not None and time_ms <= self.last_time_ms:
+                continue
+            if self.indicator == "sma":
+                if len(self.window) == period:
+                    # The deque drops its oldest close on append
+                    self.window_sum -= self.window[0]
+                self.window.append(close)
+                self.window_sum += close
+            elif self.indicator == "ema":
+                self.ema = close if self.ema is None else self.ema + (close - self.ema) * 2 / (period + 1)
+            elif self.last_close is not None:
+                change = close - self.last_close
+                gain, loss = max(change, 0.0), max(-change, 0.0)
+                if self.bars <= period:
+                    # Seed the Wilder averages with the simple mean of the first period changes
+                    self.avg_gain += gain / period
+                    self.avg_loss += loss / period
+                else:
+                    self.avg_gain = (self.avg_gain * (period - 1) + gain) / period
+                    self.avg_loss = (self.avg_loss * (period - 1) + loss) / period
+            self.last_time_ms = time_ms
+            self.last_close = close
+            self.bars += 1
+            applied += 1
+        return applied
+
+    def value(self) -> Optional[float]:
+        """
+        Current indicator value, or None while the state is still warming up
+        """
+        if self.indicator == "sma":
+            return self.window_sum / self.period if len(self.window) == self.period else None
+        if self.indicator == "ema":
+            return self.ema
+        if self.bars <= self.period:
+            return None
+        return float(_rsi_from_averages(np.float64(self.avg_gain), np.float64(self.avg_loss)))
+
+    def copy(self) -> "IndicatorState":
+        return IndicatorState.from_dict(self.to_dict())
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self), window=list(self.window))
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "IndicatorState":
+        state = cls(data["ticker"], data["indicator"], data["period"])
+        state.__dict__.update(data)
+        state.window = deque(data["window"], maxlen=state.period)
+        return state
+
+
+def indicator_state_key(ticker: str, indicator: str, period: int) -> str:
+    return f"{ticker.upper()}_{indicator}_{period}"
+
+
+class IndicatorStateStore:
+    """
+    Keeps indicator states in memory, so a warm Lambda reuses them across invocations,
+    and persists them as JSON files in a directory (INDICATOR_STATE_DIR, /tmp by
+    default) so that a local worker or a new container can pick them up again
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._states: Dict[str, IndicatorState] = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, ticker: str, indicator: str, period: int) -> Optional[IndicatorState]:
+        key = indicator_state_key(ticker, indicator, period)
+        if key not in self._states and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key)) as f:
+                    self._states[key] = IndicatorState.from_dict(json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable indicator state {key}: {str(e)}")
+        return self._states.get(key)
+
+    def put(self, state: IndicatorState) -> None:
+        self._states[state.key] = state
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(state.key)}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state.to_dict(), f)
+            os.replace(tmp_path, self._path(state.key))
+        except OSError as e:
+            logger.warning(f"Could not persist indicator state {state.key}: {str(e)}")
+
+
+indicator_states = IndicatorStateStore(os.environ.get("INDICATOR_STATE_DIR", DEFAULT_INDICATOR_STATE_DIR))
+
+
+def get_latest_indicator(ticker: str, indicator: str, period: int = DEFAULT_PERIOD) -> Dict:
+    """
+    Get the most recent value of an SMA, EMA or RSI indicator for a ticker. The first
+    call builds the indicator state from a history window; later calls only fetch the
+    bars that arrived since the state was last advanced. Bars of the current day may
+    still change, so they are applied to a copy of the state and never persisted
+    """
+    ticker = ticker.upper()
+    name = INDICATOR_ALIASES.get(indicator.lower(), indicator.lower())
+    if name not in INCREMENTAL_INDICATORS:
+        return {"error": f"Unsupported indicator for incremental updates: {indicator}",
+                "supported_indicators": list(INCREMENTAL_INDICATORS)}
+    today = datetime.utcnow()
+    state = indicator_states.get(ticker, name, period)
+    if state is None:
+        state = IndicatorState(ticker, name, period)
+        bootstrap_bars = max(period * INCREMENTAL_BOOTSTRAP_FACTOR, INCREMENTAL_MIN_BOOTSTRAP_BARS)
+        start_date = trading_calendar.trading_days_before(today.strftime("%Y-%m-%d"), bootstrap_bars)
+    else:
+        start_date = datetime.utcfromtimestamp(state.last_time_ms / 1000).strftime("%Y-%m-%d")
+
+    series = price_stores["day"].get_series(
+        ticker=ticker,
+        start_date=start_date,
+        end_date=today.strftime("%Y-%m-%d")
+    )
+    if isinstance(series, dict):
+        return series
+
+    times_ms = series.times.tolist()
+    closes = series.close.tolist()
+    # Only bars of completed days are committed to the persisted state
+    completed = int(np.searchsorted(series.times, date_to_epoch_ms(today.strftime("%Y-%m-%d"))))
+    new_bars = state.advance(times_ms[:completed], closes[:completed])
+    indicator_states.put(state)
+    latest = state.copy()
+    new_bars += latest.advance(times_ms[completed:], closes[completed:])
+
+    result = {"ticker": ticker, "indicator": name, "period": period, "new_bars": new_bars, "value": latest.value()}
+    if latest.last_time_ms is not None:
+        result["time"] = datetime.utcfromtimestamp(latest.last_time_ms / 1000).strftime("%Y-%m-%d %H:%M:%S")
+        result["time_milliseconds"] = latest.last_time_ms
+    return result
+
+
+def parse_options(options: Optional[str]) -> Dict[str, str]:
+    """
+    Parse the `options` parameter of a function: name=value pairs separated by commas
+    or semicolons
+    """
+    parsed = {}
+    for pair in re.split(r"[,;]", options or ""):
+        if not pair.strip():
+            continue
+        name, separator, value = pair.partition("=")
+        if not separator or not name.strip() or not value.strip():
+            raise ValueError(f"Invalid option '{pair.strip()}', expected name=value")
+        parsed[name.strip().lower()] = value.strip()
+    return parsed
+
+
+def get_optional_parameter(event, name, default=None):
+    """
+    Get a parameter from the lambda event, or from its `options` parameter, or the
+    default when the agent did not send it
+    """
+    value = next((item['value'] for item in event.get('parameters', []) if item['name'] == name and item['value'] != ''), None)
+    if value is None:
+        value = parse_options(next((item['value'] for item in event.get('parameters', []) if item['name'] == 'options'), None)).get(name)
+    return default if value is None else value
+
+
 def populate_function_response(event, response_body):
+    # Serialize the response once, compactly, and only log its size rather than the
+    # whole payload
+    body = json.dumps(response_body, separators=(',', ':'))
+    logger.info(f"Response size for {event.get('function', '')}: {len(body)} bytes")
     return {
         'response': {
             'actionGroup': event['actionGroup'],
             'function': event['function'],
             'functionResponse': {
-                'responseBody': response_body
+                'responseBody': {
+                    'TEXT': {
+                        'body': body
+                    }
+                }
             }
         }
     }
@@ -178,6 +2113,13 @@ def lambda_handler(event, context):
     
     try:
         response = {}
+        options = parse_options(get_optional_parameter(event, "options"))
+        unknown_options = sorted(set(options) - set(FUNCTION_OPTIONS.get(function, ())))
+        if unknown_options:
+            return populate_function_response(event, {
+                "error": f"Unsupported options for {function}: {', '.join(unknown_options)}",
+                "supported_options": list(FUNCTION_OPTIONS.get(function, ()))
+            })
         
         # If the user is asking for the current stock price, then identify the ticker, 
         # and return the latest stock price
@@ -186,7 +2128,6 @@ def lambda_handler(event, context):
             ticker = get_named_parameter(event, "ticker")
             logger.info(f"Ticker: {ticker}")
             response = get_current_stock_price(ticker)
-            logger.info(f"Response: {json.dumps(response)}")
         
         # if the user is asking for data on the stock price for a ticker for a time period then
         # this is the function that the agent calls
@@ -196,34 +2137,149 @@ def lambda_handler(event, context):
             start_date = get_named_parameter(event, "start_date")
             end_date = get_named_parameter(event, "end_date")
             limit = int(get_named_parameter(event, "limit"))
-            logger.info(f"Parameters: ticker={ticker}, start_date={start_date}, end_date={end_date}, limit={limit}")
+            interval = get_optional_parameter(event, "interval", DEFAULT_INTERVAL)
+            output_format = get_optional_parameter(event, "output_format", DEFAULT_OUTPUT_FORMAT)
+            max_points = get_optional_parameter(event, "max_points")
+            logger.info(f"Parameters: ticker={ticker}, start_date={start_date}, end_date={end_date}, limit={limit}, interval={interval}, output_format={output_format}, max_points={max_points}")
             
             response = get_stock_prices(
                 ticker=ticker,
                 start_date=start_date,
                 end_date=end_date,
-                limit=limit
+                limit=limit,
+                interval=interval,
+                output_format=output_format,
+                max_points=int(max_points) if max_points else None,
+                max_bytes=RESPONSE_MAX_BYTES
             )
-            logger.info(f"Response: {json.dumps(response)}")
             
+        # If the user wants to compare indicators across several tickers, then this is the
+        # function that the agent calls, with a comma separated list of tickers
+        elif function == 'get_batch_technical_indicators':
+            logger.info("Executing get_batch_technical_indicators")
+            tickers = get_named_parameter(event, "tickers")
+            indicator = get_named_parameter(event, "indicator")
+            period = int(get_optional_parameter(event, "period", DEFAULT_PERIOD))
+
+            response = get_batch_technical_indicators(
+                tickers=tickers,
+                indicator=indicator,
+                period=period,
+                start_date=get_optional_parameter(event, "start_date"),
+                end_date=get_optional_parameter(event, "end_date"),
+                interval=get_optional_parameter(event, "interval", DEFAULT_INTERVAL)
+            )
+
+        # If the user is asking how tickers move together or relative to a benchmark
+        # (correlation, beta, rolling volatility or Sharpe), then this is the function
+        # that the agent calls, with a comma separated list of tickers
+        elif function == 'get_correlations':
+            logger.info("Executing get_correlations")
+            tickers = get_named_parameter(event, "tickers")
+            window = get_optional_parameter(event, "window")
+            risk_free_rate = get_optional_parameter(event, "risk_free_rate")
+
+            response = get_correlations(
+                tickers=tickers,
+                benchmark=get_optional_parameter(event, "benchmark", DEFAULT_BENCHMARK),
+                start_date=get_optional_parameter(event, "start_date"),
+                end_date=get_optional_parameter(event, "end_date"),
+                window=int(window) if window else DEFAULT_RISK_WINDOW,
+                risk_free_rate=float(risk_free_rate) if risk_free_rate else DEFAULT_RISK_FREE_RATE,
+                include_covariance=str(get_optional_parameter(event, "include_covariance", "false")).lower() == "true"
+            )
+
+        # If the user is asking about the risk of a portfolio (value at risk or expected
+        # shortfall), then this is the function that the agent calls with the holdings
+        elif function == 'get_portfolio_risk':
+            logger.info("Executing get_portfolio_risk")
+            holdings = get_named_parameter(event, "holdings")
+            confidence = get_optional_parameter(event, "confidence")
+            horizon_days = get_optional_parameter(event, "horizon_days")
+            simulations = get_optional_parameter(event, "simulations")
+            seed = get_optional_parameter(event, "seed")
+            portfolio_value = get_optional_parameter(event, "portfolio_value")
+
+            response = get_portfolio_risk(
+                holdings=holdings,
+                confidence=float(confidence) if confidence else DEFAULT_VAR_CONFIDENCE,
+                horizon_days=int(horizon_days) if horizon_days else DEFAULT_VAR_HORIZON_DAYS,
+                start_date=get_optional_parameter(event, "start_date"),
+                end_date=get_optional_parameter(event, "end_date"),
+                simulations=int(simulations) if simulations else DEFAULT_MC_SIMULATIONS,
+                seed=int(seed) if seed else None,
+                portfolio_value=float(portfolio_value) if portfolio_value else None
+            )
+
+        # If the user is asking how a trading rule would have performed, then this is
+        # the function that the agent calls with the tickers and the strategy
+        elif function == 'backtest_strategy':
+            logger.info("Executing backtest_strategy")
+            tickers = get_named_parameter(event, "tickers")
+            strategy = get_named_parameter(event, "strategy")
+
+            response = backtest_strategy(
+                tickers=tickers,
+                strategy=strategy,
+                start_date=get_optional_parameter(event, "start_date"),
+                end_date=get_optional_parameter(event, "end_date")
+            )
+
+        # If the user only needs the most recent value of an indicator, then this is the
+        # function that the agent calls, which keeps the indicator state current incrementally
+        elif function == 'get_latest_indicator':
+            logger.info("Executing get_latest_indicator")
+            ticker = get_named_parameter(event, "ticker")
+            indicator = get_named_parameter(event, "indicator")
+            period = int(get_named_parameter(event, "period")) if "period" in [p["name"] for p in event["parameters"]] else DEFAULT_PERIOD
+
+            response = get_latest_indicator(
+                ticker=ticker,
+                indicator=indicator,
+                period=period
+            )
+
+        # If the user is asking about support and resistance levels, swing points or
+        # breakouts, then this is the function that the agent calls
+        elif function == 'get_price_levels':
+            logger.info("Executing get_price_levels")
+            ticker = get_named_parameter(event, "ticker")
+            window = get_optional_parameter(event, "window")
+            tolerance = get_optional_parameter(event, "tolerance")
+
+            response = get_price_levels(
+                ticker=ticker,
+                start_date=get_optional_parameter(event, "start_date"),
+                end_date=get_optional_parameter(event, "end_date"),
+                interval=get_optional_parameter(event, "interval", DEFAULT_INTERVAL),
+                window=int(window) if window else DEFAULT_SWING_WINDOW,
+                tolerance=float(tolerance) if tolerance else DEFAULT_LEVEL_TOLERANCE
+            )
+
         # If the user is looking to get technical indicators on the stock, for example the SMA, etc
         # then this is the function that the agent calls
         elif function == 'get_technical_indicators':
             logger.info("Executing get_technical_indicators")
             ticker = get_named_parameter(event, "ticker")
             indicator = get_named_parameter(event, "indicator")
-            start_date = get_named_parameter(event, "start_date")
-            end_date = get_named_parameter(event, "end_date")
-            period = int(get_named_parameter(event, "period")) if "period" in [p["name"] for p in event["parameters"]] else DEFAULT_PERIOD
+            start_date = get_optional_parameter(event, "start_date")
+            end_date = get_optional_parameter(event, "end_date")
+            period = int(get_optional_parameter(event, "period", DEFAULT_PERIOD))
+            interval = get_optional_parameter(event, "interval", DEFAULT_INTERVAL)
+            output_format = get_optional_parameter(event, "output_format", DEFAULT_OUTPUT_FORMAT)
+            max_points = get_optional_parameter(event, "max_points")
             
             response = get_technical_indicators(
                 ticker=ticker,
                 indicator=indicator,
                 period=period,
                 start_date=start_date,
-                end_date=end_date
+                end_date=end_date,
+                interval=interval,
+                output_format=output_format,
+                max_points=int(max_points) if max_points else None,
+                max_bytes=RESPONSE_MAX_BYTES
             )
-            logger.info(f"Response: {json.dumps(response)}")
             
         else:
             logger.warning(f"Invalid function: {function}")
@@ -233,7 +2289,6 @@ def lambda_handler(event, context):
             }
             
         final_response = populate_function_response(event, response)
-        logger.info(f"Final response: {json.dumps(final_response)}")
         return final_response
         
     except Exception as e:
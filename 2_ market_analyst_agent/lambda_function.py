@@ -1,12 +1,44 @@
 import os
 import sys
 import json
-from typing import Optional, Dict, Union
+from datetime import datetime
+from typing import Optional, Dict, List, Union
 
 # Import requests that is downloaded as a part of the lambda layer
 # attachment
 sys.path.append("/opt/python/lib/python3.9/site-packages/")
 import requests
+import numpy as np
+
+# Annual risk-free rate used to price options, when the agent does not pass one
+DEFAULT_RISK_FREE_RATE: float = float(os.environ.get("RISK_FREE_RATE", 0.04))
+
+# Implied volatility solver: volatility bracket searched, price tolerance and the most
+# Newton/bisection iterations. Options expire at the US market close (20:00 UTC)
+IV_BOUNDS: tuple = (1e-4, 5.0)
+IV_PRICE_TOLERANCE: float = 1e-6
+IV_MAX_ITERATIONS: int = 100
+EXPIRATION_HOUR_UTC: int = 20
+SECONDS_PER_YEAR: float = 365 * 24 * 60 * 60
+
+# The implied volatility is only reported when the option price is at least one tick
+# and a one-tick price change moves it by at most IV_MAX_TICK_SENSITIVITY; otherwise
+# (near-zero vega, e.g. far out of or deep in the money) the price does not determine it
+OPTION_TICK_SIZE: float = 0.01
+IV_MAX_TICK_SENSITIVITY: float = 0.05
+
+# Fields of the contracts of the options chain response read by the analytics stage,
+# and the ones every contract needs besides a price (bid and ask, or last price)
+OPTION_CONTRACT_FIELDS: Dict[str, str] = {
+    "strike": "strike_price",
+    "expiration": "expiration_date",
+    "type": "option_type",
+    "bid": "bid",
+    "ask": "ask",
+    "last": "last_price",
+    "underlying": "underlying_price",
+}
+OPTION_REQUIRED_FIELDS: tuple = ("strike", "expiration", "type")
 
 
 def get_named_parameter(event, name):
@@ -16,10 +48,193 @@ def get_named_parameter(event, name):
     return next(item for item in event['parameters'] if item['name'] == name)['value']
 
 
+def get_optional_parameter(event, name, default=None):
+    """
+    Get a parameter from the lambda event, or the default when the agent did not send it
+    """
+    return next((item['value'] for item in event.get('parameters', []) if item['name'] == name and item['value'] != ''), default)
+
+
+def _norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+
+def _norm_cdf(x: np.ndarray) -> np.ndarray:
+    """
+    Standard normal CDF from a Chebyshev fit of erfc (fractional error below 1.2e-7
+    everywhere), since numpy has no vectorized erf
+    """
+    z = np.abs(x) / np.sqrt(2)
+    t = 1 / (1 + 0.5 * z)
+    erfc = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (
+        -0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277)))))))))
+    return np.where(x >= 0, 1 - 0.5 * erfc, 0.5 * erfc)
+
+
+def black_scholes(spot: np.ndarray, strike: np.ndarray, years: np.ndarray, rate: float,
+                  volatility: np.ndarray, is_call: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Black-Scholes price and Greeks of every contract at once: delta, gamma, vega (per
+    1.00 of volatility) and theta (per year)
+    """
+    sqrt_years = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * volatility ** 2) * years) / (volatility * sqrt_years)
+    d2 = d1 - volatility * sqrt_years
+    discount = strike * np.exp(-rate * years)
+    density = _norm_pdf(d1)
+    call_price = spot * _norm_cdf(d1) - discount * _norm_cdf(d2)
+    decay = -spot * density * volatility / (2 * sqrt_years)
+    return {
+        "price": np.where(is_call, call_price, call_price - spot + discount),
+        "delta": np.where(is_call, _norm_cdf(d1), _norm_cdf(d1) - 1),
+        "gamma": density / (spot * volatility * sqrt_years),
+        "vega": spot * density * sqrt_years,
+        "theta": np.where(is_call, decay - rate * discount * _norm_cdf(d2), decay + rate * discount * _norm_cdf(-d2)),
+    }
+
+
+def implied_volatility(price: np.ndarray, spot: np.ndarray, strike: np.ndarray, years: np.ndarray,
+                       rate: float, is_call: np.ndarray) -> np.ndarray:
+    """
+    Implied volatility of every contract at once with a safeguarded Newton method: each
+    contract keeps a bracket around its root that shrinks with every evaluation, takes
+    the Newton step when it stays inside the bracket and bisects otherwise (flat vega
+    far from the money). Prices outside the no-arbitrage bounds have no implied
+    volatility (NaN), nor have prices that do not determine it (see
+    IV_MAX_TICK_SENSITIVITY). Only contracts that have not converged are evaluated again
+    """
+    discount = strike * np.exp(-rate * years)
+    lower_bound = np.where(is_call, np.maximum(spot - discount, 0), np.maximum(discount - spot, 0))
+    upper_bound = np.where(is_call, spot, discount)
+    valid = np.isfinite(price) & (years > 0) & (price > lower_bound) & (price < upper_bound)
+
+    low = np.full(price.shape, IV_BOUNDS[0])
+    high = np.full(price.shape, IV_BOUNDS[1])
+    # Brenner-Subrahmanyam approximation as the starting point
+    with np.errstate(divide="ignore", invalid="ignore"):
+        volatility = np.clip(np.sqrt(2 * np.pi / years) * price / spot, 0.05, 2.0)
+    volatility = np.where(valid, volatility, np.nan)
+    active = np.flatnonzero(valid)
+    for _ in range(IV_MAX_ITERATIONS):
+        if not len(active):
+            break
+        sigma = volatility[active]
+        model = black_scholes(spot[active], strike[active], years[active], rate, sigma, is_call[active])
+        error = model["price"] - price[active]
+        converged = np.abs(error) < IV_PRICE_TOLERANCE
+        high[active] = np.where(error > 0, sigma, high[active])
+        low[active] = np.where(error < 0, sigma, low[active])
+        with np.errstate(all="ignore"):
+            newton = sigma - error / model["vega"]
+        inside = np.isfinite(newton) & (newton > low[active]) & (newton < high[active])
+        step = np.where(inside, newton, 0.5 * (low[active] + high[active]))
+        volatility[active] = np.where(converged, sigma, step)
+        active = active[~converged & (high[active] - low[active] > 1e-10)]
+
+    solved = np.flatnonzero(np.isfinite(volatility))
+    vega = black_scholes(spot[solved], strike[solved], years[solved], rate, volatility[solved], is_call[solved])["vega"]
+    determined = (price[solved] >= OPTION_TICK_SIZE) & (vega * IV_MAX_TICK_SENSITIVITY >= OPTION_TICK_SIZE)
+    volatility[solved[~determined]] = np.nan
+    return volatility
+
+
+def _contract_values(contracts: List[Dict], field: str) -> np.ndarray:
+    """
+    A numeric field of every contract (see OPTION_CONTRACT_FIELDS) as a float array,
+    NaN where it is missing or not a number
+    """
+    key = OPTION_CONTRACT_FIELDS[field]
+    values = np.full(len(contracts), np.nan)
+    for i, contract in enumerate(contracts):
+        try:
+            values[i] = float(contract.get(key))
+        except (TypeError, ValueError):
+            pass
+    return values
+
+
+def _contract_expirations(contracts: List[Dict]) -> np.ndarray:
+    """
+    Expiration time of every contract, NaT where the date is missing or unparsable
+    """
+    key = OPTION_CONTRACT_FIELDS["expiration"]
+    expirations = np.full(len(contracts), np.datetime64("NaT"), dtype="datetime64[s]")
+    for i, contract in enumerate(contracts):
+        try:
+            expirations[i] = np.datetime64(str(contract.get(key) or "")[:10], "D")
+        except ValueError:
+            pass
+    return expirations + np.timedelta64(EXPIRATION_HOUR_UTC, "h")
+
+
+def add_option_analytics(contracts: List[Dict], spot: float, rate: float,
+                         now: Optional[datetime] = None) -> Dict:
+    """
+    Add the implied volatility and the delta, gamma, vega (per volatility point) and
+    theta (per calendar day) to every contract of an options chain, computed for all
+    contracts at once. The option price is the bid/ask midpoint, or the last price
+    when there is no two-sided quote. Contracts with a missing or invalid field have
+    no analytics. Returns a summary of the computation, or an error when the chain
+    lacks a field of OPTION_CONTRACT_FIELDS altogether
+    """
+    missing = [OPTION_CONTRACT_FIELDS[field] for field in OPTION_REQUIRED_FIELDS
+               if all(contract.get(OPTION_CONTRACT_FIELDS[field]) is None for contract in contracts)]
+    if all(all(contract.get(OPTION_CONTRACT_FIELDS[field]) is None for contract in contracts) for field in ("bid", "last")):
+        missing.append(f"{OPTION_CONTRACT_FIELDS['bid']}/{OPTION_CONTRACT_FIELDS['ask']} or {OPTION_CONTRACT_FIELDS['last']}")
+    if missing:
+        return {"error": f"The options chain has no {', '.join(missing)} field"}
+
+    now = np.datetime64(now or datetime.utcnow(), "s")
+    strike = _contract_values(contracts, "strike")
+    bid = _contract_values(contracts, "bid")
+    ask = _contract_values(contracts, "ask")
+    last = _contract_values(contracts, "last")
+    price = np.where((bid > 0) & (ask >= bid), 0.5 * (bid + ask), last)
+    option_types = np.array([str(contract.get(OPTION_CONTRACT_FIELDS["type"]) or "").lower() for contract in contracts])
+    is_call = option_types == "call"
+    price[~is_call & (option_types != "put")] = np.nan
+    expirations = _contract_expirations(contracts)
+    years = np.where(np.isnat(expirations), np.nan, (expirations - now).astype(float) / SECONDS_PER_YEAR)
+    spots = np.full(len(contracts), float(spot))
+
+    volatility = implied_volatility(price, spots, strike, years, rate, is_call)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        greeks = black_scholes(spots, strike, years, rate, volatility, is_call)
+    columns = {
+        "implied_volatility": volatility,
+        "delta": greeks["delta"],
+        "gamma": greeks["gamma"],
+        "vega": greeks["vega"] / 100,
+        "theta": greeks["theta"] / 365,
+    }
+    rounded = {name: np.round(values, 6).tolist() for name, values in columns.items()}
+    for i, contract in enumerate(contracts):
+        contract["analytics"] = {name: None if values[i] != values[i] else values[i] for name, values in rounded.items()}
+    solved = int(np.isfinite(volatility).sum())
+    return {"underlying_price": spot, "risk_free_rate": rate, "contracts": len(contracts),
+            "solved": solved, "unsolved": len(contracts) - solved}
+
+
+def get_underlying_price(ticker: str, api_key: str) -> Optional[float]:
+    """
+    Latest price of the underlying from the price snapshot
+    """
+    try:
+        response = requests.get(f"https://api.financialdatasets.ai/prices/snapshot?ticker={ticker}",
+                                headers={'X-API-Key': api_key})
+        return response.json().get("snapshot", {}).get("price")
+    except Exception as e:
+        print(f"Error fetching the price of {ticker}: {e}")
+        return None
+
+
 def get_options_chain(ticker: str, limit: int = 10, strike_price: Optional[float] = None,
-                     option_type: Optional[str] = None) -> Dict:
+                     option_type: Optional[str] = None, analytics: bool = True,
+                     risk_free_rate: float = DEFAULT_RISK_FREE_RATE) -> Dict:
     """
     Get options chain data for a ticker with optional filters for strike price and option type.
+    With analytics, the implied volatility and Greeks of every contract are added (see
+    add_option_analytics), priced off the underlying price of the chain or its snapshot.
     """
     api_key = os.environ.get("FINANCIAL_DATASET_API")
     print(f"Fetched the financial dataset API key: {api_key}")
@@ -37,10 +252,26 @@ def get_options_chain(ticker: str, limit: int = 10, strike_price: Optional[float
     url = 'https://api.financialdatasets.ai/options/chain'
     try:
         response = requests.get(url, headers={'X-API-Key': api_key}, params=params)
-        return response.json()
+        result = response.json()
     except Exception as e:
         return {"ticker": ticker, "options_chain": [], "error": str(e)}
 
+    contracts = result.get("options_chain") if isinstance(result, dict) else None
+    if analytics and contracts:
+        # The chain is returned even when the analytics cannot be computed
+        try:
+            spot = next((c[OPTION_CONTRACT_FIELDS["underlying"]] for c in contracts
+                         if c.get(OPTION_CONTRACT_FIELDS["underlying"])), None)
+            spot = spot or get_underlying_price(ticker, api_key)
+            if spot:
+                result["analytics"] = add_option_analytics(contracts, float(spot), risk_free_rate)
+            else:
+                result["analytics"] = {"error": "The underlying price is not available"}
+        except Exception as e:
+            print(f"Error computing the options analytics of {ticker}: {e}")
+            result["analytics"] = {"error": str(e)}
+    return result
+
 
 def get_insider_trades(ticker: str, limit: int = 10) -> Dict:
     """
@@ -134,7 +365,11 @@ def lambda_handler(event, context):
             if not ticker:
                 result = 'Missing required parameter: ticker'
             else:
-                response = get_options_chain(ticker, limit, strike_price, option_type)
+                risk_free_rate = get_optional_parameter(event, "risk_free_rate")
+                response = get_options_chain(
+                    ticker, limit, strike_price, option_type,
+                    risk_free_rate=float(risk_free_rate) if risk_free_rate else DEFAULT_RISK_FREE_RATE
+                )
                 result = response
 
         # If the user is asking to get insider trades on any company, then this is the function